@@ -1,6 +1,6 @@
 import streamlit as st
-import random
 from datetime import datetime
+import io
 import json
 from db import (
     create_tables,
@@ -19,8 +19,28 @@ from db import (
     delete_food_category,
     save_weekly_plan,
     get_weekly_plans,
+    get_weekly_plan_summaries,
     delete_weekly_plan,
-    update_weekly_plan_name
+    update_weekly_plan_name,
+    save_plan_series,
+    get_plan_series,
+    delete_plan_series,
+    clone_diet,
+    get_food_frequency,
+    get_meal_food_frequency,
+    get_rating_distribution,
+    get_weekly_variety,
+    get_row_versions,
+    ConcurrentModificationError
+)
+from logic import generate_weekly_plan, iter_plan_horizon
+from shopping import aggregate_plans, aggregate_saved_plans, totals_by_category
+from export import EXPORT_FORMATS, export_plans
+from tenancy import (
+    activate_tenant,
+    get_catalog_diets,
+    instantiate_template,
+    run_as_tenant
 )
 
 st.set_page_config(
@@ -29,85 +49,62 @@ st.set_page_config(
     layout="wide"
 )
 
+client_profile = st.sidebar.text_input(
+    "👤 Client profile",
+    key="client_profile",
+    help="Each client gets their own database. Leave empty to use the "
+         "shared one."
+)
+tenant = client_profile.strip()
+activate_tenant(tenant)
+
 create_tables()
 
-# Initialize session state for shuffled plan
-if 'current_plan' not in st.session_state:
-    st.session_state.current_plan = None
 
+def run_versioned(user_id, action, *args, expected_version=None):
+    """
+    Button callback running a delete/rename against the row version that
+    was displayed; a change made meanwhile in another session is reported
+    instead of being overwritten. Callbacks run before the script body, so
+    the tenant the page was rendered for is activated here.
+    """
+    try:
+        run_as_tenant(user_id, action, *args,
+                      expected_version=expected_version)
+    except ConcurrentModificationError:
+        st.session_state.conflict_message = (
+            "This item was changed in another session in the meantime. "
+            "The page shows its current state; please try again.")
 
-def generate_weekly_plan(diet_id, meal_categories):
-    """Generate a 7-day meal plan"""
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday",
-            "Sunday"]
-    plan = {}
 
-    for day in days:
-        plan[day] = {}
+def rename_plan(user_id, plan_id, old_name, expected_version):
+    """Rename button callback; the new name is read from the text input"""
+    new_name = st.session_state[f"rename_{plan_id}"]
+    if new_name.strip() and new_name != old_name:
+        run_versioned(user_id, update_weekly_plan_name, plan_id, new_name,
+                      expected_version=expected_version)
 
-        for cat_id, cat_name, _ in meal_categories:
-            foods = get_foods_by_category(cat_id)
 
-            if not foods:
-                plan[day][cat_name] = []
-                continue
-
-            # Separate mandatory and optional foods
-            mandatory_foods = [f for f in foods if
-                               f[5] == 1]  # f[5] is mandatory
-            optional_foods = [f for f in foods if f[5] == 0]
-
-            selected_foods = []
-
-            # Always include mandatory foods
-            for food in mandatory_foods:
-                selected_foods.append({
-                    'name': food[1],
-                    'type': food[2],
-                    'portion': food[3],
-                    'rating': food[4],
-                    'mandatory': True
-                })
-
-            # Group optional foods by food category type
-            foods_by_type = {}
-            for food in optional_foods:
-                food_type = food[2]  # food[2] is food_type
-                if food_type not in foods_by_type:
-                    foods_by_type[food_type] = []
-                foods_by_type[food_type].append(food)
-
-            # Select at least one food from each food category type
-            for food_type, type_foods in foods_by_type.items():
-                # Weight by rating: rating^2 for more preference to high ratings
-                weights = [f[4] ** 2 for f in type_foods]  # f[4] is rating
-                selected = random.choices(type_foods, weights=weights, k=1)[0]
-
-                selected_foods.append({
-                    'name': selected[1],
-                    'type': selected[2],
-                    'portion': selected[3],
-                    'rating': selected[4],
-                    'mandatory': False
-                })
-
-            plan[day][cat_name] = selected_foods
-
-    return plan
+if st.session_state.get("conflict_message"):
+    st.warning(st.session_state.pop("conflict_message"))
+
+# Initialize session state for shuffled plan
+if 'current_plan' not in st.session_state:
+    st.session_state.current_plan = None
+
+if 'current_series' not in st.session_state:
+    st.session_state.current_series = None
 
 
 def display_weekly_plan(plan):
     """Display the weekly plan in a nice format"""
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday",
-            "Sunday"]
-
-    for day in days:
+    for day, meals in plan.items():
         st.subheader(f"📅 {day}")
 
-        if day in plan:
-            cols = st.columns(len(plan[day]))
+        if meals:
+            cols = st.columns(len(meals))
 
-            for col, (meal_name, foods) in zip(cols, plan[day].items()):
+            for col, (meal_name, foods) in zip(cols, meals.items()):
                 with col:
                     st.markdown(f"**{meal_name}**")
 
@@ -124,11 +121,38 @@ def display_weekly_plan(plan):
         st.divider()
 
 
+def display_shopping_list(rows):
+    """Display an aggregated shopping list and its per-category totals"""
+    if not rows:
+        st.caption("_Nothing to buy_")
+        return
+
+    st.dataframe(
+        [{"Food": row["food"],
+          "Category": row["category"],
+          "Quantity": row["quantity"],
+          "Unit": row["unit"],
+          "Servings": row["servings"]} for row in rows],
+        use_container_width=True,
+        hide_index=True
+    )
+
+    st.markdown("**Per category**")
+    st.dataframe(
+        [{"Category": row["category"],
+          "Quantity": row["quantity"],
+          "Unit": row["unit"],
+          "Servings": row["servings"]} for row in totals_by_category(rows)],
+        use_container_width=True,
+        hide_index=True
+    )
+
+
 st.title("🥗 Diet Automation MVP")
 
 # Tabs for different sections
-tab1, tab2, tab3 = st.tabs(
-    ["📝 Manage Diet", "🎲 Generate Plan", "⭐ Saved Plans"])
+tab1, tab2, tab3, tab4 = st.tabs(
+    ["📝 Manage Diet", "🎲 Generate Plan", "⭐ Saved Plans", "📊 Analytics"])
 
 with tab1:
     st.subheader("Create and manage your diets")
@@ -167,6 +191,42 @@ with tab1:
     selected_diet_id = diet_options[selected_diet_name]
     ensure_default_food_categories(selected_diet_id)
 
+    with st.expander("📋 Copy this diet for a new client"):
+        with st.form("clone_diet_form"):
+            clone_name = st.text_input(
+                "New diet name",
+                value=f"{selected_diet_name} (copy)"
+            )
+            clone_btn = st.form_submit_button("📋 Clone diet")
+
+            if clone_btn:
+                if clone_name.strip():
+                    clone_diet(selected_diet_id, clone_name)
+                    st.success(f"Cloned into '{clone_name}'!")
+                    st.rerun()
+                else:
+                    st.warning("Please enter a diet name.")
+
+    if tenant:
+        template_diets = get_catalog_diets()
+
+        if template_diets:
+            with st.expander("📚 Start from a template"):
+                with st.form("template_diet_form"):
+                    template_options = {name: template_id
+                                        for template_id, name in template_diets}
+                    template_name = st.selectbox(
+                        "Template",
+                        options=template_options.keys()
+                    )
+                    template_btn = st.form_submit_button("➕ Use template")
+
+                    if template_btn:
+                        instantiate_template(template_options[template_name],
+                                             template_name)
+                        st.success(f"Added '{template_name}' from templates!")
+                        st.rerun()
+
     st.divider()
 
     # Predefined meal categories
@@ -199,14 +259,19 @@ with tab1:
     if not categories:
         st.info("No meal categories added yet.")
     else:
+        category_versions = get_row_versions(
+            "meal_categories", [cat_id for cat_id, _, _ in categories])
+
         for cat_id, category_name, _ in categories:
             col1, col2 = st.columns([8, 1])
             col1.markdown(f"### {category_name}")
 
-            if col2.button("🗑️", key=f"del_meal_{cat_id}",
-                           help="Delete this meal category"):
-                delete_meal_category(cat_id)
-                st.rerun()
+            col2.button("🗑️", key=f"del_meal_{cat_id}",
+                        help="Delete this meal category",
+                        on_click=run_versioned,
+                        args=(tenant, delete_meal_category, cat_id),
+                        kwargs={"expected_version":
+                                category_versions.get(cat_id)})
 
             # -------- ADD FOOD FORM --------
             with st.form(f"add_food_{cat_id}"):
@@ -260,14 +325,19 @@ with tab1:
 
                 if food_categories:
                     st.write("**Current food categories:**")
+                    food_category_versions = get_row_versions(
+                        "food_categories",
+                        [fc_id for fc_id, _, _ in food_categories])
+
                     for fc_id, name, _ in food_categories:
                         col1, col2 = st.columns([8, 1])
                         col1.write(f"• {name}")
 
-                        if col2.button("❌",
-                                       key=f"del_food_cat_{cat_id}_{fc_id}"):
-                            delete_food_category(fc_id)
-                            st.rerun()
+                        col2.button("❌", key=f"del_food_cat_{cat_id}_{fc_id}",
+                                    on_click=run_versioned,
+                                    args=(tenant, delete_food_category, fc_id),
+                                    kwargs={"expected_version":
+                                            food_category_versions.get(fc_id)})
 
                     st.write("")
                 else:
@@ -299,6 +369,9 @@ with tab1:
             if not foods:
                 st.caption("No foods added yet.")
             else:
+                food_versions = get_row_versions(
+                    "foods", [food[0] for food in foods])
+
                 for food_id, name, ftype, portion, rating, mandatory in foods:
                     col1, col2 = st.columns([8, 1])
 
@@ -311,9 +384,11 @@ with tab1:
 
                     col1.write(label)
 
-                    if col2.button("❌", key=f"del_food_{food_id}"):
-                        delete_food(food_id)
-                        st.rerun()
+                    col2.button("❌", key=f"del_food_{food_id}",
+                                on_click=run_versioned,
+                                args=(tenant, delete_food, food_id),
+                                kwargs={"expected_version":
+                                        food_versions.get(food_id)})
 
             st.divider()
 
@@ -354,20 +429,27 @@ with tab2:
 
     st.divider()
 
+    avoid_recent = st.checkbox(
+        "🕒 Avoid recently served foods",
+        key="avoid_recent_foods",
+        help="Down-weight foods that appeared in recently saved plans"
+    )
+    weighting = "recency" if avoid_recent else "rating"
+
     col1, col2 = st.columns(2)
 
     with col1:
         if st.button("🎲 Shuffle New Plan", type="primary",
                      use_container_width=True):
             st.session_state.current_plan = generate_weekly_plan(
-                selected_diet_id_shuffle, meal_categories)
+                selected_diet_id_shuffle, meal_categories, weighting)
             st.rerun()
 
     with col2:
         if st.button("🔄 Shuffle Again", use_container_width=True,
                      disabled=st.session_state.current_plan is None):
             st.session_state.current_plan = generate_weekly_plan(
-                selected_diet_id_shuffle, meal_categories)
+                selected_diet_id_shuffle, meal_categories, weighting)
             st.rerun()
 
     st.divider()
@@ -375,6 +457,10 @@ with tab2:
     if st.session_state.current_plan:
         display_weekly_plan(st.session_state.current_plan)
 
+        with st.expander("🛒 Shopping list for this week"):
+            display_shopping_list(
+                aggregate_plans([st.session_state.current_plan]))
+
         st.divider()
         st.subheader("💾 Save This Plan")
 
@@ -397,6 +483,44 @@ with tab2:
     else:
         st.info("Click 'Shuffle New Plan' to generate your weekly meal plan!")
 
+    st.divider()
+    st.subheader("📆 Multi-Week Plan")
+
+    horizon_weeks = st.number_input("Number of weeks", min_value=2,
+                                    max_value=52, value=4,
+                                    key="horizon_weeks")
+
+    if st.button("🎲 Generate Multi-Week Plan", key="generate_series_btn"):
+        st.session_state.current_series = list(iter_plan_horizon(
+            selected_diet_id_shuffle, meal_categories,
+            weeks=int(horizon_weeks), weighting=weighting))
+        st.rerun()
+
+    if st.session_state.current_series:
+        for week_number, week_plan in enumerate(
+                st.session_state.current_series, start=1):
+            with st.expander(f"🗓 Week {week_number}"):
+                display_weekly_plan(week_plan)
+
+        with st.form("save_series_form"):
+            default_name = f"Plan from {datetime.now().strftime('%b %d, %Y')}"
+            series_name = st.text_input("Multi-week plan name",
+                                        value=default_name)
+
+            save_series_btn = st.form_submit_button("⭐ Save All Weeks")
+
+            if save_series_btn:
+                if series_name.strip():
+                    save_plan_series(
+                        selected_diet_id_shuffle,
+                        series_name,
+                        st.session_state.current_series
+                    )
+                    st.success(f"✅ Saved '{series_name}' "
+                               f"({len(st.session_state.current_series)} weeks)!")
+                else:
+                    st.warning("Please enter a plan name.")
+
 with tab3:
     st.subheader("⭐ Your Saved Plans")
 
@@ -414,12 +538,34 @@ with tab3:
     )
 
     selected_diet_id_saved = diet_options[selected_diet_name_saved]
+
+    plan_series = get_plan_series(selected_diet_id_saved)
+    if plan_series:
+        st.markdown("**📆 Multi-week plans**")
+        series_versions = get_row_versions(
+            "plan_series", [series[0] for series in plan_series])
+
+        for series_id, series_name, created_at, weeks in plan_series:
+            col1, col2 = st.columns([8, 1])
+            col1.write(f"{series_name} — {weeks} weeks (Created: {created_at})")
+
+            col2.button("🗑️", key=f"delete_series_{series_id}",
+                        help="Delete this plan and all of its weeks",
+                        on_click=run_versioned,
+                        args=(tenant, delete_plan_series, series_id),
+                        kwargs={"expected_version":
+                                series_versions.get(series_id)})
+        st.divider()
+
     saved_plans = get_weekly_plans(selected_diet_id_saved)
 
     if not saved_plans:
         st.info(
             "No saved plans yet. Generate and save a plan in the 'Generate Plan' tab!")
     else:
+        plan_versions = get_row_versions(
+            "weekly_plans", [plan[0] for plan in saved_plans])
+
         for plan_id, plan_name, created_at, plan_data_json in saved_plans:
             with st.expander(f"📋 {plan_name} (Created: {created_at})"):
                 plan_data = json.loads(plan_data_json)
@@ -427,23 +573,161 @@ with tab3:
                 # Option to rename
                 col1, col2, col3 = st.columns([3, 1, 1])
 
-                new_name = col1.text_input(
+                col1.text_input(
                     "Rename plan",
                     value=plan_name,
                     key=f"rename_{plan_id}",
                     label_visibility="collapsed"
                 )
 
-                if col2.button("✏️ Rename", key=f"rename_btn_{plan_id}"):
-                    if new_name.strip() and new_name != plan_name:
-                        update_weekly_plan_name(plan_id, new_name)
-                        st.success("Renamed!")
-                        st.rerun()
+                col2.button("✏️ Rename", key=f"rename_btn_{plan_id}",
+                            on_click=rename_plan,
+                            args=(tenant, plan_id, plan_name,
+                                  plan_versions.get(plan_id)))
 
-                if col3.button("🗑️ Delete", key=f"delete_plan_{plan_id}"):
-                    delete_weekly_plan(plan_id)
-                    st.success("Deleted!")
-                    st.rerun()
+                col3.button("🗑️ Delete", key=f"delete_plan_{plan_id}",
+                            on_click=run_versioned,
+                            args=(tenant, delete_weekly_plan, plan_id),
+                            kwargs={"expected_version":
+                                    plan_versions.get(plan_id)})
 
                 st.divider()
-                display_weekly_plan(plan_data)
\ No newline at end of file
+                display_weekly_plan(plan_data)
+
+    st.divider()
+    st.subheader("🛒 Shopping List")
+
+    shopping_diet_names = st.multiselect(
+        "Diets to shop for",
+        options=list(diet_options.keys()),
+        default=[selected_diet_name_saved],
+        key="shopping_diet_select"
+    )
+
+    shopping_plan_options = {}
+    for diet_name in shopping_diet_names:
+        for plan_id, plan_name, created_at in get_weekly_plan_summaries(
+                diet_options[diet_name]):
+            shopping_plan_options[
+                f"{diet_name} · {plan_name} ({created_at})"] = plan_id
+
+    selected_shopping_plans = st.multiselect(
+        "Plans (leave empty for all plans of the selected diets)",
+        options=list(shopping_plan_options.keys()),
+        key="shopping_plan_select"
+    )
+
+    if shopping_diet_names:
+        if selected_shopping_plans:
+            shopping_rows = aggregate_saved_plans(
+                plan_ids=[shopping_plan_options[label]
+                          for label in selected_shopping_plans])
+        else:
+            shopping_rows = aggregate_saved_plans(
+                diet_ids=[diet_options[name] for name in shopping_diet_names])
+        display_shopping_list(shopping_rows)
+
+    st.divider()
+    st.subheader("📤 Export Plans")
+
+    col1, col2 = st.columns(2)
+
+    export_format = col1.selectbox(
+        "Format",
+        options=list(EXPORT_FORMATS.keys()),
+        format_func=str.upper,
+        key="export_format_select"
+    )
+
+    export_scope = col2.radio(
+        "Plans to export",
+        options=["This diet", "All diets"],
+        horizontal=True,
+        key="export_scope_radio"
+    )
+
+    if st.button("📦 Prepare export", key="prepare_export_btn"):
+        export_buffer = io.BytesIO()
+        export_plans(
+            export_format,
+            export_buffer,
+            diet_ids=[selected_diet_id_saved]
+            if export_scope == "This diet" else None
+        )
+
+        _, extension, mime = EXPORT_FORMATS[export_format]
+        st.download_button(
+            "⬇️ Download",
+            data=export_buffer.getvalue(),
+            file_name=f"weekly_plans_{datetime.now():%Y%m%d}.{extension}",
+            mime=mime,
+            key="download_export_btn"
+        )
+
+with tab4:
+    st.subheader("📊 Plan History Analytics")
+
+    diets = get_diets()
+
+    if not diets:
+        st.warning("Please create a diet first.")
+        st.stop()
+
+    diet_options = {name: diet_id for diet_id, name in diets}
+    selected_diet_name_stats = st.selectbox(
+        "Select a diet to analyze",
+        options=diet_options.keys(),
+        key="analytics_diet_select"
+    )
+
+    selected_diet_id_stats = diet_options[selected_diet_name_stats]
+    food_frequency = get_food_frequency(selected_diet_id_stats)
+
+    if not food_frequency:
+        st.info("No saved plans yet. Save a plan to see its analytics here!")
+    else:
+        col1, col2 = st.columns(2)
+
+        with col1:
+            st.markdown("**🍽 Most served foods**")
+            st.dataframe(
+                [{"Food": name, "Category": ftype, "Times served": total}
+                 for name, ftype, total in food_frequency],
+                use_container_width=True,
+                hide_index=True
+            )
+
+        with col2:
+            st.markdown("**⭐ Rating distribution**")
+            ratings = get_rating_distribution(selected_diet_id_stats)
+            st.bar_chart(
+                {"Rating": [str(rating) for rating, _ in ratings],
+                 "Times served": [count for _, count in ratings]},
+                x="Rating",
+                y="Times served"
+            )
+
+        st.divider()
+        st.markdown("**📅 Weekly variety**")
+        variety = list(reversed(get_weekly_variety(selected_diet_id_stats,
+                                                   limit=52)))
+        st.line_chart(
+            {"Week": [week for week, _, _, _ in variety],
+             "Distinct foods": [distinct for _, _, distinct, _ in variety]},
+            x="Week",
+            y="Distinct foods"
+        )
+
+        st.divider()
+        st.markdown("**🥣 Food frequency per meal**")
+        per_meal = {}
+        for meal_name, food_name, times_served in get_meal_food_frequency(
+                selected_diet_id_stats):
+            per_meal.setdefault(meal_name, []).append(
+                {"Food": food_name, "Times served": times_served})
+
+        cols = st.columns(len(per_meal))
+        for col, (meal_name, rows) in zip(cols, per_meal.items()):
+            with col:
+                st.markdown(f"**{meal_name}**")
+                st.dataframe(rows, use_container_width=True, hide_index=True)
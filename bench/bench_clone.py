@@ -0,0 +1,94 @@
+"""
+Benchmark clone_diet() on a diet with 5,000 foods.
+
+Builds the source diet in a temporary database, clones it several times
+and prints the fastest and median time, then checks every copy against
+the source tree. Run from the repository root:
+
+    python bench/bench_clone.py [--foods N] [--runs N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def build_source_diet(food_count: int):
+    """A diet with 5 meal categories, the default food categories and
+    food_count foods spread over them; returns its id"""
+    db.add_diet("Benchmark source")
+    diet_id = db.get_diets()[0][0]
+
+    for i in range(5):
+        db.add_meal_category(diet_id, f"Meal {i}")
+    db.ensure_default_food_categories(diet_id)
+
+    meal_ids = [cat_id for cat_id, _, _ in db.get_meal_categories(diet_id)]
+    food_types = [name for _, name, _ in db.get_food_categories(diet_id)]
+
+    with db.write_transaction() as cursor:
+        cursor.executemany(
+            """
+            INSERT INTO foods (
+                diet_id, meal_category_id, name, food_type, portion,
+                rating, mandatory
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(diet_id, meal_ids[i % len(meal_ids)], f"Food {i}",
+              food_types[i % len(food_types)], f"{10 + i % 90}g",
+              i % 5 + 1, int(i % 97 == 0))
+             for i in range(food_count)]
+        )
+
+    return diet_id
+
+
+def diet_tree(diet_id: int):
+    """Everything a clone must reproduce, without ids"""
+    meals = [
+        (name, order_index,
+         sorted(food[1:] for food in db.get_foods_by_category(cat_id)))
+        for cat_id, name, order_index in db.get_meal_categories(diet_id)
+    ]
+    food_categories = [fc[1:] for fc in db.get_food_categories(diet_id)]
+    return meals, food_categories
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--foods", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        db.create_tables()
+
+        source_id = build_source_diet(args.foods)
+        source_tree = diet_tree(source_id)
+
+        timings = []
+        clone_ids = []
+        for run in range(args.runs):
+            start = time.perf_counter()
+            clone_ids.append(db.clone_diet(source_id, f"Copy {run}"))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        for clone_id in clone_ids:
+            assert diet_tree(clone_id) == source_tree, \
+                f"diet {clone_id} differs from the source"
+
+    print(f"clone_diet, {args.foods} foods, {args.runs} runs: "
+          f"min {min(timings):.1f} ms, median {statistics.median(timings):.1f} ms")
+    print("all copies match the source")
+
+
+if __name__ == "__main__":
+    main()
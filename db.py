@@ -1,9 +1,15 @@
 import sqlite3
 import json
-from datetime import datetime
+import time
+from contextvars import ContextVar
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 DB_PATH = "data/diet_app.db"
 
+# Half-life of the per-food recency score used by history-aware sampling
+RECENCY_HALF_LIFE_DAYS = 14
+
 DEFAULT_FOOD_CATEGORIES = [
     "Fruits",
     "Vegetables",
@@ -13,18 +19,277 @@ DEFAULT_FOOD_CATEGORIES = [
 ]
 
 
+# How long a connection waits on a locked database before giving up, and
+# how many times a write transaction retries acquiring the write lock
+BUSY_TIMEOUT_SECONDS = 5
+WRITE_LOCK_RETRIES = 5
+
+# Compact the change log once this many entries (local writes or merged
+# ones) have been appended since the last compaction
+COMPACT_EVERY_OPS = 1000
+
+# Tables whose rows carry a version column for optimistic locking
+VERSIONED_TABLES = (
+    "diets",
+    "meal_categories",
+    "foods",
+    "food_categories",
+    "weekly_plans",
+    "plan_series"
+)
+
+
+# Tables replicated through the change log, parents before children, with
+# the JSON payload describing a row of alias t (references as parent uids)
+SYNC_TABLES = {
+    "diets": "json_object('name', t.name)",
+    "meal_categories": """json_object(
+        'diet_uid', (SELECT uid FROM diets WHERE id = t.diet_id),
+        'name', t.name,
+        'order_index', t.order_index)""",
+    "food_categories": """json_object(
+        'diet_uid', (SELECT uid FROM diets WHERE id = t.diet_id),
+        'name', t.name,
+        'order_index', t.order_index)""",
+    "foods": """json_object(
+        'diet_uid', (SELECT uid FROM diets WHERE id = t.diet_id),
+        'meal_category_uid',
+            (SELECT uid FROM meal_categories WHERE id = t.meal_category_id),
+        'name', t.name,
+        'food_type', t.food_type,
+        'portion', t.portion,
+        'rating', t.rating,
+        'mandatory', t.mandatory)""",
+    "plan_series": """json_object(
+        'diet_uid', (SELECT uid FROM diets WHERE id = t.diet_id),
+        'name', t.name,
+        'created_at', t.created_at,
+        'weeks', t.weeks)""",
+    "weekly_plans": """json_object(
+        'diet_uid', (SELECT uid FROM diets WHERE id = t.diet_id),
+        'series_uid', (SELECT uid FROM plan_series WHERE id = t.series_id),
+        'series_index', t.series_index,
+        'name', t.name,
+        'created_at', t.created_at,
+        'plan_data', t.plan_data)"""
+}
+
+# Payload keys that reference a parent row: key -> (column, parent table)
+SYNC_REFERENCES = {
+    "diet_uid": ("diet_id", "diets"),
+    "meal_category_uid": ("meal_category_id", "meal_categories"),
+    "series_uid": ("series_id", "plan_series")
+}
+
+# Rows deleted together with a synced row: table -> (child table, column)
+SYNC_CHILDREN = {
+    "diets": (
+        ("meal_categories", "diet_id"),
+        ("food_categories", "diet_id"),
+        ("foods", "diet_id"),
+        ("plan_series", "diet_id"),
+        ("weekly_plans", "diet_id")
+    ),
+    "meal_categories": (("foods", "meal_category_id"),),
+    "plan_series": (("weekly_plans", "series_id"),)
+}
+
+# Optional callable returning the connection to use instead of DB_PATH,
+# set per thread/context (see tenancy.py)
+CONNECTION_FACTORY = ContextVar("connection_factory", default=None)
+
+
+class ConcurrentModificationError(Exception):
+    """A row was changed or deleted since the caller read its version"""
+
+
 def get_connection():
-    return sqlite3.connect("data/diet_app.db")
+    factory = CONNECTION_FACTORY.get()
+    if factory is not None:
+        return factory()
+    return sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_SECONDS)
+
+
+@contextmanager
+def write_transaction():
+    """
+    Run a block of writes in one BEGIN IMMEDIATE transaction.
+
+    The write lock is taken up front, so reads inside the block cannot be
+    invalidated by another writer. Acquiring the lock waits for the busy
+    timeout and is retried with backoff; the block is committed on success
+    and rolled back on any exception.
+    """
+    conn = get_connection()
+    conn.isolation_level = None
+    cursor = conn.cursor()
+
+    try:
+        for attempt in range(WRITE_LOCK_RETRIES):
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if ("locked" not in str(e)
+                        or attempt == WRITE_LOCK_RETRIES - 1):
+                    raise
+                time.sleep(0.05 * 2 ** attempt)
+
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+        cursor.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def _ensure_column(cursor, table: str, column: str, definition: str):
+    """Add a column to an existing table if it is missing; True if added"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+
+def _check_version(cursor, table: str, row_id: int, expected_version):
+    """
+    Raise ConcurrentModificationError if the row is gone or its version
+    differs from expected_version. No check when expected_version is None.
+    """
+    if expected_version is None:
+        return
+
+    cursor.execute(f"SELECT version FROM {table} WHERE id = ?", (row_id,))
+    row = cursor.fetchone()
+
+    if row is None or row[0] != expected_version:
+        raise ConcurrentModificationError(
+            f"{table} row {row_id} was modified by another session"
+        )
+
+
+def get_row_version(table: str, row_id: int):
+    """Current version of a row, or None if it does not exist"""
+    if table not in VERSIONED_TABLES:
+        raise ValueError(f"{table} has no version column")
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(f"SELECT version FROM {table} WHERE id = ?", (row_id,))
+    row = cursor.fetchone()
+
+    conn.close()
+    return row[0] if row else None
+
+
+def get_row_versions(table: str, row_ids):
+    """
+    Current versions of several rows as {row id: version}, to pass back
+    as expected_version when the user acts on what was displayed
+    """
+    if table not in VERSIONED_TABLES:
+        raise ValueError(f"{table} has no version column")
+
+    row_ids = list(row_ids)
+    if not row_ids:
+        return {}
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    placeholders = ", ".join("?" * len(row_ids))
+    cursor.execute(
+        f"SELECT id, version FROM {table} WHERE id IN ({placeholders})",
+        row_ids
+    )
+
+    versions = dict(cursor.fetchall())
+    conn.close()
+    return versions
+
+
+def _log_changes(cursor, table: str, op: str, where: str, params=()):
+    """
+    Append an 'upsert' (after writing) or 'delete' (before deleting) entry
+    to change_log for every row of table matching where. Set-based, so a
+    whole diet can be logged with one statement.
+    """
+    payload = SYNC_TABLES[table] if op == "upsert" else "'{}'"
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    cursor.execute(
+        """
+        SELECT (SELECT value FROM replica_meta WHERE key = 'replica_id'),
+               (SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence
+                WHERE name = 'change_log')
+        """
+    )
+    replica_id, last_seq = cursor.fetchone()
+
+    # seq is numbered here rather than by AUTOINCREMENT so the op id,
+    # "<replica>:<seq>", is written in the same statement
+    cursor.execute(
+        f"""
+        INSERT INTO change_log (
+            seq, op_id, replica_id, table_name, row_uid, op, payload,
+            created_at
+        )
+        SELECT ? + ROW_NUMBER() OVER (ORDER BY t.id),
+               printf('%s:%012d', ?, ? + ROW_NUMBER() OVER (ORDER BY t.id)),
+               ?, '{table}', t.uid, '{op}', {payload}, ?
+        FROM {table} t
+        WHERE {where}
+        ORDER BY t.id
+        """,
+        (last_seq, replica_id, last_seq, replica_id, created_at, *params)
+    )
+
+    _maybe_compact_change_log(cursor)
+
+
+def _delete_rows(cursor, table: str, where: str, params=()):
+    """
+    Delete the rows of a synced table matching where (alias t) together
+    with their SYNC_CHILDREN, children first, logging every deleted row.
+    The same cascade runs for local deletes and merged ones, so replicas
+    agree on what a delete removes.
+    """
+    cursor.execute(f"SELECT t.id FROM {table} t WHERE {where}", params)
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        return
+
+    placeholders = ", ".join("?" * len(ids))
+    for child_table, column in SYNC_CHILDREN.get(table, ()):
+        _delete_rows(cursor, child_table, f"t.{column} IN ({placeholders})",
+                     ids)
+
+    if table == "weekly_plans":
+        for plan_id in ids:
+            _remove_plan_items(cursor, plan_id)
+
+    _log_changes(cursor, table, "delete", f"t.id IN ({placeholders})", ids)
+    cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
 
 
 def create_tables():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
 
+    # WAL lets readers proceed while a writer holds the lock
+    cursor.execute("PRAGMA main.journal_mode=WAL")
+
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS diets (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        uid TEXT
     )
     """)
 
@@ -34,6 +299,8 @@ def create_tables():
         diet_id INTEGER NOT NULL,
         name TEXT NOT NULL,
         order_index INTEGER NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        uid TEXT,
         FOREIGN KEY (diet_id) REFERENCES diets (id)
     )
     """)
@@ -48,6 +315,8 @@ def create_tables():
         portion TEXT,
         rating INTEGER DEFAULT 3,
         mandatory INTEGER DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 0,
+        uid TEXT,
         FOREIGN KEY (diet_id) REFERENCES diets (id),
         FOREIGN KEY (meal_category_id) REFERENCES meal_categories (id)
     )
@@ -59,6 +328,22 @@ def create_tables():
         diet_id INTEGER NOT NULL,
         name TEXT NOT NULL,
         order_index INTEGER NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        uid TEXT,
+        FOREIGN KEY (diet_id) REFERENCES diets (id)
+    )
+    """)
+
+    # Parent record of a multi-week plan; its weeks are weekly_plans rows
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_series (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        diet_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        weeks INTEGER NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        uid TEXT,
         FOREIGN KEY (diet_id) REFERENCES diets (id)
     )
     """)
@@ -70,26 +355,199 @@ def create_tables():
         name TEXT NOT NULL,
         created_at TEXT NOT NULL,
         plan_data TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        series_id INTEGER,
+        series_index INTEGER,
+        uid TEXT,
+        items_recorded INTEGER NOT NULL DEFAULT 0,
+        recency_recorded INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (diet_id) REFERENCES diets (id),
+        FOREIGN KEY (series_id) REFERENCES plan_series (id)
+    )
+    """)
+
+    # Databases created before optimistic locking lack the version column
+    for table in VERSIONED_TABLES:
+        _ensure_column(cursor, table, "version", "INTEGER NOT NULL DEFAULT 0")
+
+    _ensure_column(cursor, "weekly_plans", "series_id", "INTEGER")
+    _ensure_column(cursor, "weekly_plans", "series_index", "INTEGER")
+
+    # Databases created before plan_items need their plans normalized once
+    plans_to_backfill = _ensure_column(
+        cursor, "weekly_plans", "items_recorded", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(cursor, "weekly_plans", "recency_recorded",
+                   "INTEGER NOT NULL DEFAULT 0")
+
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_weekly_plans_recency_pending
+    ON weekly_plans (created_at) WHERE recency_recorded = 0
+    """)
+
+    # Replication: every synced row gets a global uid on insert, and every
+    # mutation is appended to change_log
+    rows_to_snapshot = False
+    for table in SYNC_TABLES:
+        rows_to_snapshot |= _ensure_column(cursor, table, "uid", "TEXT")
+        cursor.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_uid ON {table} (uid)"
+        )
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS assign_uid_{table}
+        AFTER INSERT ON {table} WHEN NEW.uid IS NULL
+        BEGIN
+            UPDATE {table} SET uid = lower(hex(randomblob(16)))
+            WHERE id = NEW.id;
+        END
+        """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS replica_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """)
+
+    cursor.execute("SELECT 1 FROM replica_meta WHERE key = 'replica_id'")
+    if not cursor.fetchone():
+        cursor.execute("""
+        INSERT INTO replica_meta (key, value)
+        VALUES ('replica_id', lower(hex(randomblob(16))))
+        """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        op_id TEXT UNIQUE,
+        replica_id TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        row_uid TEXT NOT NULL,
+        op TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_change_log_row
+        ON change_log (table_name, row_uid)
+        """
+    )
+
+    # Highest change_log seq of each peer replica already merged here
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_peers (
+        replica_id TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    # Normalized copy of every saved plan, one row per served food
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        plan_id INTEGER NOT NULL,
+        diet_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        meal_name TEXT NOT NULL,
+        food_name TEXT NOT NULL,
+        food_type TEXT NOT NULL,
+        portion TEXT,
+        rating INTEGER,
+        mandatory INTEGER DEFAULT 0,
+        FOREIGN KEY (plan_id) REFERENCES weekly_plans (id),
         FOREIGN KEY (diet_id) REFERENCES diets (id)
     )
     """)
 
-    conn.commit()
-    conn.close()
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_plan_items_plan ON plan_items (plan_id)"
+    )
 
+    # Aggregates maintained incrementally on save/delete of a plan, so
+    # analytics never have to scan the plan history
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_food_stats (
+        diet_id INTEGER NOT NULL,
+        meal_name TEXT NOT NULL,
+        food_name TEXT NOT NULL,
+        food_type TEXT NOT NULL,
+        times_served INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (diet_id, meal_name, food_name)
+    )
+    """)
 
-def add_diet(name: str):
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_rating_stats (
+        diet_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL,
+        times_served INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (diet_id, rating)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_week_stats (
+        diet_id INTEGER NOT NULL,
+        week TEXT NOT NULL,
+        plans INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (diet_id, week)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS plan_week_food_stats (
+        diet_id INTEGER NOT NULL,
+        week TEXT NOT NULL,
+        food_name TEXT NOT NULL,
+        times_served INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (diet_id, week, food_name)
+    )
+    """)
 
+    # Exponentially decayed "how recently was this served" score per food,
+    # valid as of updated_at
     cursor.execute(
-        "INSERT INTO diets (name) VALUES (?)",
-        (name,)
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+        "AND name = 'food_recency'"
+    )
+    recency_to_backfill = cursor.fetchone() is None
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS food_recency (
+        diet_id INTEGER NOT NULL,
+        meal_name TEXT NOT NULL,
+        food_name TEXT NOT NULL,
+        score REAL NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (diet_id, meal_name, food_name)
     )
+    """)
 
     conn.commit()
     conn.close()
 
+    # One-time migrations; an up-to-date database takes no write lock here
+    if plans_to_backfill:
+        backfill_plan_items()
+    if recency_to_backfill:
+        backfill_food_recency()
+    if rows_to_snapshot:
+        snapshot_untracked_rows()
+    record_due_recency()
+
+
+def add_diet(name: str):
+    with write_transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO diets (name) VALUES (?)",
+            (name,)
+        )
+
+        _log_changes(cursor, "diets", "upsert", "t.id = ?",
+                     (cursor.lastrowid,))
+
 
 def get_diets():
     conn = get_connection()
@@ -103,25 +561,23 @@ def get_diets():
 
 
 def add_meal_category(diet_id: int, name: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT COALESCE(MAX(order_index), 0) + 1 FROM meal_categories WHERE diet_id = ?",
-        (diet_id,)
-    )
-    next_order = cursor.fetchone()[0]
+    with write_transaction() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(MAX(order_index), 0) + 1 FROM meal_categories WHERE diet_id = ?",
+            (diet_id,)
+        )
+        next_order = cursor.fetchone()[0]
 
-    cursor.execute(
-        """
-        INSERT INTO meal_categories (diet_id, name, order_index)
-        VALUES (?, ?, ?)
-        """,
-        (diet_id, name, next_order)
-    )
+        cursor.execute(
+            """
+            INSERT INTO meal_categories (diet_id, name, order_index)
+            VALUES (?, ?, ?)
+            """,
+            (diet_id, name, next_order)
+        )
 
-    conn.commit()
-    conn.close()
+        _log_changes(cursor, "meal_categories", "upsert", "t.id = ?",
+                     (cursor.lastrowid,))
 
 
 def get_meal_categories(diet_id: int):
@@ -143,63 +599,76 @@ def get_meal_categories(diet_id: int):
     return categories
 
 
-def move_meal_category(category_id: int, direction: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT diet_id, order_index FROM meal_categories WHERE id = ?",
-        (category_id,)
-    )
-    diet_id, current_order = cursor.fetchone()
+def move_meal_category(category_id: int, direction: str,
+                       expected_version: int = None):
+    """
+    Swap a meal category with its neighbor above or below.
+    Pass expected_version to fail with ConcurrentModificationError if the
+    category changed since it was read.
+    """
+    with write_transaction() as cursor:
+        _check_version(cursor, "meal_categories", category_id,
+                       expected_version)
 
-    if direction == "up":
-        cursor.execute(
-            """
-            SELECT id, order_index FROM meal_categories
-            WHERE diet_id = ? AND order_index < ?
-            ORDER BY order_index DESC LIMIT 1
-            """,
-            (diet_id, current_order)
-        )
-    else:
         cursor.execute(
-            """
-            SELECT id, order_index FROM meal_categories
-            WHERE diet_id = ? AND order_index > ?
-            ORDER BY order_index ASC LIMIT 1
-            """,
-            (diet_id, current_order)
+            "SELECT diet_id, order_index FROM meal_categories WHERE id = ?",
+            (category_id,)
         )
+        category = cursor.fetchone()
+        if category is None:
+            return
+        diet_id, current_order = category
 
-    neighbor = cursor.fetchone()
-    if neighbor:
-        neighbor_id, neighbor_order = neighbor
+        if direction == "up":
+            cursor.execute(
+                """
+                SELECT id, order_index FROM meal_categories
+                WHERE diet_id = ? AND order_index < ?
+                ORDER BY order_index DESC LIMIT 1
+                """,
+                (diet_id, current_order)
+            )
+        else:
+            cursor.execute(
+                """
+                SELECT id, order_index FROM meal_categories
+                WHERE diet_id = ? AND order_index > ?
+                ORDER BY order_index ASC LIMIT 1
+                """,
+                (diet_id, current_order)
+            )
 
-        cursor.execute(
-            "UPDATE meal_categories SET order_index = ? WHERE id = ?",
-            (neighbor_order, category_id)
-        )
-        cursor.execute(
-            "UPDATE meal_categories SET order_index = ? WHERE id = ?",
-            (current_order, neighbor_id)
-        )
+        neighbor = cursor.fetchone()
+        if neighbor:
+            neighbor_id, neighbor_order = neighbor
 
-    conn.commit()
-    conn.close()
+            cursor.execute(
+                """
+                UPDATE meal_categories
+                SET order_index = ?, version = version + 1
+                WHERE id = ?
+                """,
+                (neighbor_order, category_id)
+            )
+            cursor.execute(
+                """
+                UPDATE meal_categories
+                SET order_index = ?, version = version + 1
+                WHERE id = ?
+                """,
+                (current_order, neighbor_id)
+            )
 
+            _log_changes(cursor, "meal_categories", "upsert",
+                         "t.id IN (?, ?)", (category_id, neighbor_id))
 
-def delete_meal_category(category_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
 
-    cursor.execute(
-        "DELETE FROM meal_categories WHERE id = ?",
-        (category_id,)
-    )
+def delete_meal_category(category_id: int, expected_version: int = None):
+    with write_transaction() as cursor:
+        _check_version(cursor, "meal_categories", category_id, expected_version)
 
-    conn.commit()
-    conn.close()
+        # The category's foods go with it
+        _delete_rows(cursor, "meal_categories", "t.id = ?", (category_id,))
 
 
 def add_food(
@@ -211,36 +680,34 @@ def add_food(
         rating,
         mandatory
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    INSERT INTO foods (
-        diet_id,
-        meal_category_id,
-        name,
-        food_type,
-        portion,
-        rating,
-        mandatory
-    )
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        diet_id,
-        meal_category_id,
-        name,
-        food_type,
-        portion,
-        rating,
-        mandatory
-    ))
+    with write_transaction() as cursor:
+        cursor.execute("""
+        INSERT INTO foods (
+            diet_id,
+            meal_category_id,
+            name,
+            food_type,
+            portion,
+            rating,
+            mandatory
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            diet_id,
+            meal_category_id,
+            name,
+            food_type,
+            portion,
+            rating,
+            mandatory
+        ))
 
-    conn.commit()
-    conn.close()
+        _log_changes(cursor, "foods", "upsert", "t.id = ?",
+                     (cursor.lastrowid,))
 
 
 def get_foods_by_category(meal_category_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -255,53 +722,44 @@ def get_foods_by_category(meal_category_id):
     return foods
 
 
-def delete_food(food_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "DELETE FROM foods WHERE id = ?",
-        (food_id,)
-    )
+def delete_food(food_id, expected_version: int = None):
+    with write_transaction() as cursor:
+        _check_version(cursor, "foods", food_id, expected_version)
 
-    conn.commit()
-    conn.close()
+        _delete_rows(cursor, "foods", "t.id = ?", (food_id,))
 
 
 def add_food_category(diet_id: int, name: str):
     """Add a new food category to a diet"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT id FROM food_categories WHERE diet_id = ? AND name = ?",
-        (diet_id, name)
-    )
+    with write_transaction() as cursor:
+        cursor.execute(
+            "SELECT id FROM food_categories WHERE diet_id = ? AND name = ?",
+            (diet_id, name)
+        )
 
-    existing = cursor.fetchone()
-    if existing:
-        conn.close()
-        return existing[0]
+        existing = cursor.fetchone()
+        if existing:
+            return existing[0]
 
-    cursor.execute(
-        "SELECT COALESCE(MAX(order_index), 0) + 1 FROM food_categories WHERE diet_id = ?",
-        (diet_id,)
-    )
-    order_index = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT COALESCE(MAX(order_index), 0) + 1 FROM food_categories WHERE diet_id = ?",
+            (diet_id,)
+        )
+        order_index = cursor.fetchone()[0]
 
-    cursor.execute(
-        """
-        INSERT INTO food_categories (diet_id, name, order_index)
-        VALUES (?, ?, ?)
-        """,
-        (diet_id, name, order_index)
-    )
+        cursor.execute(
+            """
+            INSERT INTO food_categories (diet_id, name, order_index)
+            VALUES (?, ?, ?)
+            """,
+            (diet_id, name, order_index)
+        )
+        new_id = cursor.lastrowid
 
-    new_id = cursor.lastrowid
+        _log_changes(cursor, "food_categories", "upsert", "t.id = ?",
+                     (new_id,))
 
-    conn.commit()
-    conn.close()
-    return new_id
+        return new_id
 
 
 def get_food_categories(diet_id: int):
@@ -329,72 +787,572 @@ def ensure_default_food_categories(diet_id: int):
     Ensure default food categories exist for a diet.
     Only adds them if they don't already exist (by name).
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with write_transaction() as cursor:
+        for default_name in DEFAULT_FOOD_CATEGORIES:
+            cursor.execute(
+                "SELECT id FROM food_categories WHERE diet_id = ? AND name = ?",
+                (diet_id, default_name)
+            )
+
+            if not cursor.fetchone():
+                cursor.execute(
+                    "SELECT COALESCE(MAX(order_index), 0) + 1 FROM food_categories WHERE diet_id = ?",
+                    (diet_id,)
+                )
+                order_index = cursor.fetchone()[0]
+
+                cursor.execute(
+                    """
+                    INSERT INTO food_categories (diet_id, name, order_index)
+                    VALUES (?, ?, ?)
+                    """,
+                    (diet_id, default_name, order_index)
+                )
+
+                _log_changes(cursor, "food_categories", "upsert", "t.id = ?",
+                             (cursor.lastrowid,))
+
+
+def delete_food_category(food_category_id: int,
+                         expected_version: int = None):
+    """Delete a food category"""
+    with write_transaction() as cursor:
+        _check_version(cursor, "food_categories", food_category_id, expected_version)
+
+        _delete_rows(cursor, "food_categories", "t.id = ?",
+                     (food_category_id,))
+
+
+def seed_default_food_categories(diet_id: int):
+    """
+    DEPRECATED - Use ensure_default_food_categories instead.
+    """
+    ensure_default_food_categories(diet_id)
 
-    for default_name in DEFAULT_FOOD_CATEGORIES:
+
+def clone_diet(source_diet_id: int, new_name: str,
+               source_schema: str = "main"):
+    """
+    Copy a diet with its meal categories, food categories and foods into a
+    new diet, in one transaction with set-based INSERT ... SELECT
+    statements. source_schema="catalog" instantiates a template from the
+    attached catalog database (see tenancy.py). Returns the new diet id.
+    """
+    if source_schema not in ("main", "catalog"):
+        raise ValueError(f"Unknown source schema: {source_schema}")
+
+    with write_transaction() as cursor:
         cursor.execute(
-            "SELECT id FROM food_categories WHERE diet_id = ? AND name = ?",
-            (diet_id, default_name)
+            "INSERT INTO diets (name) VALUES (?)",
+            (new_name,)
+        )
+        new_diet_id = cursor.lastrowid
+
+        cursor.execute(
+            f"""
+            INSERT INTO food_categories (diet_id, name, order_index, uid)
+            SELECT ?, name, order_index, lower(hex(randomblob(16)))
+            FROM {source_schema}.food_categories
+            WHERE diet_id = ?
+            ORDER BY id
+            """,
+            (new_diet_id, source_diet_id)
         )
 
-        if not cursor.fetchone():
+        cursor.execute(
+            f"""
+            INSERT INTO meal_categories (diet_id, name, order_index, uid)
+            SELECT ?, name, order_index, lower(hex(randomblob(16)))
+            FROM {source_schema}.meal_categories
+            WHERE diet_id = ?
+            ORDER BY id
+            """,
+            (new_diet_id, source_diet_id)
+        )
+
+        if cursor.rowcount > 0:
+            # AUTOINCREMENT ids of one INSERT ... SELECT are consecutive, so
+            # the n-th source category (by id) became first_id + n - 1
+            first_id = cursor.lastrowid - cursor.rowcount + 1
+
             cursor.execute(
-                "SELECT COALESCE(MAX(order_index), 0) + 1 FROM food_categories WHERE diet_id = ?",
-                (diet_id,)
+                f"""
+                INSERT INTO foods (
+                    diet_id, meal_category_id, name, food_type, portion,
+                    rating, mandatory, uid
+                )
+                SELECT ?, m.new_id, f.name, f.food_type, f.portion,
+                       f.rating, f.mandatory, lower(hex(randomblob(16)))
+                FROM {source_schema}.foods f
+                JOIN (
+                    SELECT id AS old_id,
+                           ? + ROW_NUMBER() OVER (ORDER BY id) - 1 AS new_id
+                    FROM {source_schema}.meal_categories
+                    WHERE diet_id = ?
+                ) m ON m.old_id = f.meal_category_id
+                WHERE f.diet_id = ?
+                ORDER BY f.id
+                """,
+                (new_diet_id, first_id, source_diet_id, source_diet_id)
             )
-            order_index = cursor.fetchone()[0]
 
+        _log_changes(cursor, "diets", "upsert", "t.id = ?", (new_diet_id,))
+        for table in ("meal_categories", "food_categories", "foods"):
+            _log_changes(cursor, table, "upsert", "t.diet_id = ?",
+                         (new_diet_id,))
+
+        return new_diet_id
+
+
+def _plan_date(created_at: str, series_index: int = None):
+    """
+    Date a plan counts for in analytics and recency: its save time, and
+    for week N of a multi-week plan N - 1 weeks later
+    """
+    date = (datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+            + timedelta(weeks=(series_index or 1) - 1))
+    return date.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _plan_week(created_at: str):
+    """ISO week key (e.g. 2024-W07) for a plan's created_at timestamp"""
+    year, week, _ = datetime.strptime(
+        created_at, "%Y-%m-%d %H:%M:%S").isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _iter_plan_foods(plan_data: dict):
+    """Yield (day, meal_name, food) for every food in a plan"""
+    for day, meals in plan_data.items():
+        for meal_name, foods in meals.items():
+            for food in foods:
+                yield day, meal_name, food
+
+
+def _update_plan_aggregates(cursor, diet_id: int, created_at: str, items,
+                            delta: int):
+    """
+    Add (delta=1) or remove (delta=-1) one plan's items from the
+    analytics aggregates. items are (meal_name, food_name, food_type, rating).
+    """
+    week = _plan_week(created_at)
+
+    cursor.execute(
+        """
+        INSERT INTO plan_week_stats (diet_id, week, plans)
+        VALUES (?, ?, ?)
+        ON CONFLICT (diet_id, week) DO UPDATE SET plans = plans + excluded.plans
+        """,
+        (diet_id, week, delta)
+    )
+
+    cursor.executemany(
+        """
+        INSERT INTO plan_food_stats
+            (diet_id, meal_name, food_name, food_type, times_served)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (diet_id, meal_name, food_name)
+        DO UPDATE SET times_served = times_served + excluded.times_served,
+                      food_type = excluded.food_type
+        """,
+        [(diet_id, meal_name, food_name, food_type, delta)
+         for meal_name, food_name, food_type, _ in items]
+    )
+
+    cursor.executemany(
+        """
+        INSERT INTO plan_rating_stats (diet_id, rating, times_served)
+        VALUES (?, ?, ?)
+        ON CONFLICT (diet_id, rating)
+        DO UPDATE SET times_served = times_served + excluded.times_served
+        """,
+        [(diet_id, rating, delta) for _, _, _, rating in items]
+    )
+
+    cursor.executemany(
+        """
+        INSERT INTO plan_week_food_stats (diet_id, week, food_name, times_served)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (diet_id, week, food_name)
+        DO UPDATE SET times_served = times_served + excluded.times_served
+        """,
+        [(diet_id, week, food_name, delta) for _, food_name, _, _ in items]
+    )
+
+    if delta < 0:
+        cursor.execute(
+            "DELETE FROM plan_week_stats WHERE diet_id = ? AND plans <= 0",
+            (diet_id,)
+        )
+        cursor.execute(
+            "DELETE FROM plan_food_stats WHERE diet_id = ? AND times_served <= 0",
+            (diet_id,)
+        )
+        cursor.execute(
+            "DELETE FROM plan_rating_stats WHERE diet_id = ? AND times_served <= 0",
+            (diet_id,)
+        )
+        cursor.execute(
+            """
+            DELETE FROM plan_week_food_stats
+            WHERE diet_id = ? AND week = ? AND times_served <= 0
+            """,
+            (diet_id, week)
+        )
+
+
+def _decay_factor(from_time: str, to_time: str):
+    """Fraction of a recency score left after the time between two timestamps"""
+    elapsed = (datetime.strptime(to_time, "%Y-%m-%d %H:%M:%S")
+               - datetime.strptime(from_time, "%Y-%m-%d %H:%M:%S"))
+    days = elapsed.total_seconds() / 86400
+    return 0.5 ** (days / RECENCY_HALF_LIFE_DAYS)
+
+
+def _update_food_recency(cursor, diet_id: int, created_at: str, items,
+                         delta: int):
+    """
+    Add (delta=1) or remove (delta=-1) one plan's servings from the
+    per-food recency scores. Only the touched foods are updated.
+    """
+    counts = {}
+    for meal_name, food_name, _, _ in items:
+        key = (meal_name, food_name)
+        counts[key] = counts.get(key, 0) + delta
+
+    for (meal_name, food_name), count in counts.items():
+        cursor.execute(
+            """
+            SELECT score, updated_at FROM food_recency
+            WHERE diet_id = ? AND meal_name = ? AND food_name = ?
+            """,
+            (diet_id, meal_name, food_name)
+        )
+        current = cursor.fetchone()
+
+        if current is None:
+            score, updated_at = count, created_at
+        else:
+            score, updated_at = current
+            if created_at >= updated_at:
+                score = score * _decay_factor(updated_at, created_at) + count
+                updated_at = created_at
+            else:
+                # Plan older than the last update: add its decayed share
+                score += count * _decay_factor(created_at, updated_at)
+
+        if score <= 1e-9:
             cursor.execute(
                 """
-                INSERT INTO food_categories (diet_id, name, order_index)
-                VALUES (?, ?, ?)
+                DELETE FROM food_recency
+                WHERE diet_id = ? AND meal_name = ? AND food_name = ?
                 """,
-                (diet_id, default_name, order_index)
+                (diet_id, meal_name, food_name)
             )
+            continue
 
-    conn.commit()
-    conn.close()
+        cursor.execute(
+            """
+            INSERT INTO food_recency
+                (diet_id, meal_name, food_name, score, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (diet_id, meal_name, food_name)
+            DO UPDATE SET score = excluded.score,
+                          updated_at = excluded.updated_at
+            """,
+            (diet_id, meal_name, food_name, score, updated_at)
+        )
 
 
-def delete_food_category(food_category_id: int):
-    """Delete a food category"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _record_plan_items(cursor, plan_id: int, plan_data: dict):
+    """
+    Write the normalized plan_items rows for a saved plan and count them.
+    Weeks of a multi-week plan that lie in the future are left out of the
+    recency scores until their date (see record_due_recency).
+    """
+    cursor.execute(
+        """
+        SELECT diet_id, created_at, series_index FROM weekly_plans
+        WHERE id = ?
+        """,
+        (plan_id,)
+    )
+    diet_id, created_at, series_index = cursor.fetchone()
+    plan_date = _plan_date(created_at, series_index)
+    is_due = plan_date <= datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    rows = [
+        (plan_id, diet_id, day, meal_name, food['name'], food['type'],
+         food.get('portion'), food.get('rating'),
+         int(bool(food.get('mandatory'))))
+        for day, meal_name, food in _iter_plan_foods(plan_data)
+    ]
+
+    cursor.executemany(
+        """
+        INSERT INTO plan_items (
+            plan_id, diet_id, day, meal_name, food_name, food_type,
+            portion, rating, mandatory
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows
+    )
 
     cursor.execute(
-        "DELETE FROM food_categories WHERE id = ?",
-        (food_category_id,)
+        """
+        UPDATE weekly_plans SET items_recorded = 1, recency_recorded = ?
+        WHERE id = ?
+        """,
+        (int(is_due), plan_id)
     )
 
-    conn.commit()
+    items = [(row[3], row[4], row[5], row[7]) for row in rows]
+    _update_plan_aggregates(cursor, diet_id, plan_date, items, 1)
+    if is_due:
+        _update_food_recency(cursor, diet_id, plan_date, items, 1)
+
+
+def _remove_plan_items(cursor, plan_id: int):
+    """Remove a plan's plan_items rows and subtract them from the aggregates"""
+    cursor.execute(
+        """
+        SELECT diet_id, created_at, series_index, recency_recorded
+        FROM weekly_plans WHERE id = ?
+        """,
+        (plan_id,)
+    )
+    plan = cursor.fetchone()
+    if not plan:
+        return
+    diet_id, created_at, series_index, recency_recorded = plan
+    plan_date = _plan_date(created_at, series_index)
+
+    cursor.execute(
+        """
+        SELECT meal_name, food_name, food_type, rating
+        FROM plan_items
+        WHERE plan_id = ?
+        """,
+        (plan_id,)
+    )
+    items = cursor.fetchall()
+
+    _update_plan_aggregates(cursor, diet_id, plan_date, items, -1)
+    if recency_recorded:
+        _update_food_recency(cursor, diet_id, plan_date, items, -1)
+
+    cursor.execute(
+        "DELETE FROM plan_items WHERE plan_id = ?",
+        (plan_id,)
+    )
+
+
+def backfill_plan_items():
+    """
+    Normalize plans saved before plan_items existed.
+    Only plans not flagged items_recorded are processed, so plans without
+    any food are counted once too.
+    """
+    with write_transaction() as cursor:
+        cursor.execute(
+            """
+            SELECT id, plan_data
+            FROM weekly_plans
+            WHERE items_recorded = 0
+            ORDER BY created_at
+            """
+        )
+        pending = cursor.fetchall()
+
+        for plan_id, plan_data_json in pending:
+            _record_plan_items(cursor, plan_id, json.loads(plan_data_json))
+
+
+_DUE_RECENCY_QUERY = """
+    SELECT id, diet_id, created_at, series_index FROM weekly_plans
+    WHERE recency_recorded = 0
+      AND datetime(created_at, printf('+%d days',
+                   7 * (COALESCE(series_index, 1) - 1))) <= ?
+"""
+
+
+def record_due_recency():
+    """
+    Add the weeks of multi-week plans whose date has come to the recency
+    scores. Runs with create_tables(), i.e. on every app start/rerun; the
+    write lock is only taken when some week is due.
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(_DUE_RECENCY_QUERY + " LIMIT 1", (now,))
+    has_due = cursor.fetchone() is not None
     conn.close()
 
+    if not has_due:
+        return
 
-def seed_default_food_categories(diet_id: int):
+    with write_transaction() as cursor:
+        cursor.execute(_DUE_RECENCY_QUERY, (now,))
+
+        for plan_id, diet_id, created_at, series_index in cursor.fetchall():
+            plan_date = _plan_date(created_at, series_index)
+
+            cursor.execute(
+                """
+                SELECT meal_name, food_name, food_type, rating
+                FROM plan_items
+                WHERE plan_id = ?
+                """,
+                (plan_id,)
+            )
+            _update_food_recency(cursor, diet_id, plan_date,
+                                 cursor.fetchall(), 1)
+
+            cursor.execute(
+                "UPDATE weekly_plans SET recency_recorded = 1 WHERE id = ?",
+                (plan_id,)
+            )
+
+
+def backfill_food_recency():
     """
-    DEPRECATED - Use ensure_default_food_categories instead.
+    Build the recency scores from plan_items when the table is still empty
+    (databases created before food_recency existed).
     """
-    ensure_default_food_categories(diet_id)
+    with write_transaction() as cursor:
+        cursor.execute("SELECT 1 FROM food_recency LIMIT 1")
+        if cursor.fetchone():
+            return
+
+        cursor.execute(
+            """
+            SELECT p.diet_id,
+                   datetime(p.created_at, printf('+%d days',
+                            7 * (COALESCE(p.series_index, 1) - 1))) AS plan_date,
+                   i.meal_name, i.food_name, COUNT(*)
+            FROM plan_items i
+            JOIN weekly_plans p ON p.id = i.plan_id
+            WHERE p.recency_recorded = 1
+            GROUP BY p.id, i.meal_name, i.food_name
+            ORDER BY plan_date
+            """
+        )
+
+        scores = {}
+        for diet_id, created_at, meal_name, food_name, count in cursor.fetchall():
+            key = (diet_id, meal_name, food_name)
+            if key in scores:
+                score, updated_at = scores[key]
+                score = score * _decay_factor(updated_at, created_at) + count
+            else:
+                score = count
+            scores[key] = (score, created_at)
+
+        cursor.executemany(
+            """
+            INSERT INTO food_recency
+                (diet_id, meal_name, food_name, score, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [key + value for key, value in scores.items()]
+        )
+
+
+def _insert_weekly_plan(cursor, diet_id: int, name: str, created_at: str,
+                        plan_data: dict, series_id: int = None,
+                        series_index: int = None):
+    """Insert a weekly_plans row with its plan_items; returns the plan id"""
+    cursor.execute(
+        """
+        INSERT INTO weekly_plans (
+            diet_id, name, created_at, plan_data, series_id, series_index
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (diet_id, name, created_at, json.dumps(plan_data), series_id,
+         series_index)
+    )
+    plan_id = cursor.lastrowid
+
+    _record_plan_items(cursor, plan_id, plan_data)
+    _log_changes(cursor, "weekly_plans", "upsert", "t.id = ?", (plan_id,))
+    return plan_id
 
 
 def save_weekly_plan(diet_id: int, name: str, plan_data: dict):
     """Save a weekly plan to favorites"""
+    with write_transaction() as cursor:
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        return _insert_weekly_plan(cursor, diet_id, name, created_at,
+                                   plan_data)
+
+
+def save_plan_series(diet_id: int, name: str, week_plans):
+    """
+    Save a multi-week plan as one plan_series row with a weekly_plans row
+    per week ("<name> - Week N"). week_plans may be a generator such as
+    logic.iter_plan_horizon; weeks are written as they are produced.
+    Returns the series id.
+    """
+    with write_transaction() as cursor:
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        cursor.execute(
+            """
+            INSERT INTO plan_series (diet_id, name, created_at, weeks)
+            VALUES (?, ?, ?, 0)
+            """,
+            (diet_id, name, created_at)
+        )
+        series_id = cursor.lastrowid
+
+        weeks = 0
+        for week_plan in week_plans:
+            weeks += 1
+            _insert_weekly_plan(cursor, diet_id, f"{name} - Week {weeks}",
+                                created_at, week_plan, series_id, weeks)
+
+        cursor.execute(
+            "UPDATE plan_series SET weeks = ? WHERE id = ?",
+            (weeks, series_id)
+        )
+
+        _log_changes(cursor, "plan_series", "upsert", "t.id = ?",
+                     (series_id,))
+
+        return series_id
+
+
+def get_plan_series(diet_id: int):
+    """Get all saved multi-week plans for a diet"""
     conn = get_connection()
     cursor = conn.cursor()
 
-    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
     cursor.execute(
         """
-        INSERT INTO weekly_plans (diet_id, name, created_at, plan_data)
-        VALUES (?, ?, ?, ?)
+        SELECT id, name, created_at, weeks
+        FROM plan_series
+        WHERE diet_id = ?
+        ORDER BY created_at DESC
         """,
-        (diet_id, name, created_at, json.dumps(plan_data))
+        (diet_id,)
     )
 
-    conn.commit()
+    series = cursor.fetchall()
     conn.close()
+    return series
+
+
+def delete_plan_series(series_id: int, expected_version: int = None):
+    """Delete a multi-week plan together with all of its weeks"""
+    with write_transaction() as cursor:
+        _check_version(cursor, "plan_series", series_id, expected_version)
+
+        _delete_rows(cursor, "plan_series", "t.id = ?", (series_id,))
 
 
 def get_weekly_plans(diet_id: int):
@@ -417,29 +1375,577 @@ def get_weekly_plans(diet_id: int):
     return plans
 
 
-def delete_weekly_plan(plan_id: int):
-    """Delete a weekly plan"""
+def get_weekly_plan_summaries(diet_id: int):
+    """Saved weekly plans of a diet as (id, name, created_at), without
+    loading their plan_data"""
     conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute(
-        "DELETE FROM weekly_plans WHERE id = ?",
-        (plan_id,)
+        """
+        SELECT id, name, created_at
+        FROM weekly_plans
+        WHERE diet_id = ?
+        ORDER BY created_at DESC
+        """,
+        (diet_id,)
     )
 
-    conn.commit()
+    plans = cursor.fetchall()
     conn.close()
+    return plans
+
+
+def iter_weekly_plans(plan_ids=None, diet_ids=None):
+    """
+    Stream saved plans as (id, diet_id, diet_name, name, created_at,
+    plan_data, series_index) with plan_data decoded, one row at a time.
+    series_index is the week number within a multi-week plan, else None.
+    Filter by plan ids and/or diet ids; with neither, all saved plans are
+    included.
+    """
+    query = """
+        SELECT p.id, p.diet_id, d.name, p.name, p.created_at, p.plan_data,
+               p.series_index
+        FROM weekly_plans p
+        JOIN diets d ON d.id = p.diet_id
+        WHERE 1 = 1
+    """
+    params = []
+
+    if plan_ids is not None:
+        plan_ids = list(plan_ids)
+        query += f" AND p.id IN ({', '.join('?' * len(plan_ids))})"
+        params.extend(plan_ids)
+
+    if diet_ids is not None:
+        diet_ids = list(diet_ids)
+        query += f" AND p.diet_id IN ({', '.join('?' * len(diet_ids))})"
+        params.extend(diet_ids)
 
+    query += " ORDER BY p.diet_id, p.created_at, p.series_index"
 
-def update_weekly_plan_name(plan_id: int, new_name: str):
+    conn = get_connection()
+    try:
+        for row in conn.execute(query, params):
+            yield row[:5] + (json.loads(row[5]), row[6])
+    finally:
+        conn.close()
+
+
+def iter_plan_item_portions(plan_ids=None, diet_ids=None):
+    """
+    Stream (food_name, food_type, portion, servings) over saved plans,
+    grouped by food and portion. Filter by plan ids and/or diet ids;
+    with neither, all saved plans are included.
+    """
+    query = """
+        SELECT food_name, food_type, portion, COUNT(*)
+        FROM plan_items
+        WHERE 1 = 1
+    """
+    params = []
+
+    if plan_ids is not None:
+        plan_ids = list(plan_ids)
+        query += f" AND plan_id IN ({', '.join('?' * len(plan_ids))})"
+        params.extend(plan_ids)
+
+    if diet_ids is not None:
+        diet_ids = list(diet_ids)
+        query += f" AND diet_id IN ({', '.join('?' * len(diet_ids))})"
+        params.extend(diet_ids)
+
+    query += " GROUP BY food_name, food_type, portion"
+
+    conn = get_connection()
+    try:
+        yield from conn.execute(query, params)
+    finally:
+        conn.close()
+
+
+def delete_weekly_plan(plan_id: int, expected_version: int = None):
+    """Delete a weekly plan"""
+    with write_transaction() as cursor:
+        _check_version(cursor, "weekly_plans", plan_id, expected_version)
+
+        _delete_rows(cursor, "weekly_plans", "t.id = ?", (plan_id,))
+
+
+def update_weekly_plan_name(plan_id: int, new_name: str,
+                            expected_version: int = None):
     """Update the name of a weekly plan"""
+    with write_transaction() as cursor:
+        _check_version(cursor, "weekly_plans", plan_id, expected_version)
+
+        cursor.execute(
+            """
+            UPDATE weekly_plans SET name = ?, version = version + 1
+            WHERE id = ?
+            """,
+            (new_name, plan_id)
+        )
+
+        _log_changes(cursor, "weekly_plans", "upsert", "t.id = ?", (plan_id,))
+
+
+def get_food_frequency(diet_id: int, meal_name: str = None, limit: int = None):
+    """
+    How often each food was served across saved plans of a diet.
+    Reads the incremental aggregates, never the plans themselves.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    query = """
+        SELECT food_name, food_type, SUM(times_served) AS total
+        FROM plan_food_stats
+        WHERE diet_id = ?
+    """
+    params = [diet_id]
+
+    if meal_name is not None:
+        query += " AND meal_name = ?"
+        params.append(meal_name)
+
+    query += " GROUP BY food_name, food_type ORDER BY total DESC, food_name"
+
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    cursor.execute(query, params)
+
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_meal_food_frequency(diet_id: int):
+    """Food frequency per meal category: (meal_name, food_name, times_served)"""
     conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute(
-        "UPDATE weekly_plans SET name = ? WHERE id = ?",
-        (new_name, plan_id)
+        """
+        SELECT meal_name, food_name, times_served
+        FROM plan_food_stats
+        WHERE diet_id = ?
+        ORDER BY meal_name, times_served DESC, food_name
+        """,
+        (diet_id,)
     )
 
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_rating_distribution(diet_id: int):
+    """Number of served foods per rating across saved plans of a diet"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT rating, times_served
+        FROM plan_rating_stats
+        WHERE diet_id = ?
+        ORDER BY rating
+        """,
+        (diet_id,)
+    )
+
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_weekly_variety(diet_id: int, limit: int = None):
+    """
+    Variety trend per ISO week: (week, plans, distinct_foods, servings),
+    most recent weeks first.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    query = """
+        SELECT w.week, w.plans,
+               COUNT(f.food_name), COALESCE(SUM(f.times_served), 0)
+        FROM plan_week_stats w
+        LEFT JOIN plan_week_food_stats f
+            ON f.diet_id = w.diet_id AND f.week = w.week
+        WHERE w.diet_id = ?
+        GROUP BY w.week, w.plans
+        ORDER BY w.week DESC
+    """
+    params = [diet_id]
+
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    cursor.execute(query, params)
+
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_food_recency_scores(diet_id: int):
+    """
+    Recency score of every served food of a diet, decayed to now.
+    Returns {(meal_name, food_name): score}; unserved foods are absent.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT meal_name, food_name, score, updated_at
+        FROM food_recency
+        WHERE diet_id = ?
+        """,
+        (diet_id,)
+    )
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    scores = {
+        (meal_name, food_name): score * _decay_factor(updated_at, now)
+        for meal_name, food_name, score, updated_at in cursor.fetchall()
+    }
+
+    conn.close()
+    return scores
+
+
+def snapshot_untracked_rows():
+    """
+    Log an upsert for every synced row that has no change_log entry yet
+    (rows written before the change log existed), so peers receive them.
+    Only runs when some row still lacks a uid.
+    """
+    with write_transaction() as cursor:
+        for table in SYNC_TABLES:
+            cursor.execute(f"SELECT 1 FROM {table} WHERE uid IS NULL LIMIT 1")
+            if not cursor.fetchone():
+                continue
+
+            cursor.execute(
+                f"UPDATE {table} SET uid = lower(hex(randomblob(16))) "
+                f"WHERE uid IS NULL"
+            )
+            _log_changes(
+                cursor, table, "upsert",
+                """NOT EXISTS (
+                    SELECT 1 FROM change_log c
+                    WHERE c.table_name = ? AND c.row_uid = t.uid
+                )""",
+                (table,)
+            )
+
+
+def get_replica_id():
+    """Id of this database in replication"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT value FROM replica_meta WHERE key = 'replica_id'")
+
+    replica_id = cursor.fetchone()[0]
+    conn.close()
+    return replica_id
+
+
+def get_peer_watermark(replica_id: str):
+    """Highest change_log seq of a peer replica already merged here"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT last_seq FROM sync_peers WHERE replica_id = ?",
+        (replica_id,)
+    )
+
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def _iter_changes(conn, query, params):
+    try:
+        yield from conn.execute(query, params)
+    finally:
+        conn.close()
+
+
+def iter_changes(since_seq: int = 0):
+    """
+    Stream change_log entries after since_seq as (seq, op_id, table_name,
+    row_uid, op, payload, created_at).
+
+    Upserts come first with parent tables before child tables, then deletes
+    in reverse order, so every entry can be applied even after compaction
+    reordered a row's surviving entry past its children's. The connection
+    is opened right away, not on first iteration.
+    """
+    upsert_order = " ".join(
+        f"WHEN '{table}' THEN {rank}" for rank, table in enumerate(SYNC_TABLES)
+    )
+    query = f"""
+        SELECT seq, op_id, table_name, row_uid, op, payload, created_at
+        FROM change_log
+        WHERE seq > ?
+        ORDER BY op = 'delete',
+                 CASE table_name {upsert_order} END
+                     * (CASE op WHEN 'delete' THEN -1 ELSE 1 END),
+                 seq
+    """
+    return _iter_changes(get_connection(), query, (since_seq,))
+
+
+def _is_latest_change(cursor, table: str, row_uid: str, created_at: str,
+                      op_id: str):
+    """Last-writer-wins: is (created_at, op_id) newer than every known entry?"""
+    cursor.execute(
+        """
+        SELECT 1 FROM change_log
+        WHERE table_name = ? AND row_uid = ? AND (created_at, op_id) > (?, ?)
+        LIMIT 1
+        """,
+        (table, row_uid, created_at, op_id)
+    )
+    return cursor.fetchone() is None
+
+
+def _replay_children(cursor, table: str, row_uid: str):
+    """
+    Re-apply child upserts that were skipped while a re-created parent row
+    was deleted here (see _apply_upsert)
+    """
+    cursor.execute(
+        """
+        SELECT 1 FROM change_log
+        WHERE table_name = ? AND row_uid = ? AND op = 'delete'
+        LIMIT 1
+        """,
+        (table, row_uid)
+    )
+    if not cursor.fetchone():
+        return
+
+    for child_table, column in SYNC_CHILDREN.get(table, ()):
+        key = next(key for key, reference in SYNC_REFERENCES.items()
+                   if reference == (column, table))
+        cursor.execute(
+            f"""
+            SELECT c.row_uid, c.payload FROM change_log c
+            WHERE c.table_name = ? AND c.op = 'upsert'
+              AND json_extract(c.payload, '$.{key}') = ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM change_log newer
+                  WHERE newer.table_name = c.table_name
+                    AND newer.row_uid = c.row_uid
+                    AND (newer.created_at, newer.op_id)
+                        > (c.created_at, c.op_id)
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM {child_table} r WHERE r.uid = c.row_uid
+              )
+            """,
+            (child_table, row_uid)
+        )
+        for child_uid, payload in cursor.fetchall():
+            _apply_upsert(cursor, child_table, child_uid, json.loads(payload))
+
+
+def _apply_upsert(cursor, table: str, row_uid: str, payload: dict):
+    """
+    Insert or update a synced row from a change payload. A row whose parent
+    was deleted here is skipped: the delete cascades to it on the replica
+    that has it, and _replay_children restores it if the parent comes back.
+    """
+    values = {}
+    for key, value in payload.items():
+        if key in SYNC_REFERENCES:
+            column, parent_table = SYNC_REFERENCES[key]
+            if value is None:
+                values[column] = None
+                continue
+            cursor.execute(f"SELECT id FROM {parent_table} WHERE uid = ?",
+                           (value,))
+            parent = cursor.fetchone()
+            if parent is None:
+                return
+            values[column] = parent[0]
+        else:
+            values[key] = value
+
+    cursor.execute(f"SELECT id FROM {table} WHERE uid = ?", (row_uid,))
+    existing = cursor.fetchone()
+
+    if table == "weekly_plans" and existing:
+        _remove_plan_items(cursor, existing[0])
+
+    if existing:
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        cursor.execute(
+            f"UPDATE {table} SET {assignments}, version = version + 1 "
+            f"WHERE id = ?",
+            (*values.values(), existing[0])
+        )
+        row_id = existing[0]
+    else:
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" * len(values))
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}, uid) "
+            f"VALUES ({placeholders}, ?)",
+            (*values.values(), row_uid)
+        )
+        row_id = cursor.lastrowid
+
+    if table == "weekly_plans":
+        _record_plan_items(cursor, row_id, json.loads(values["plan_data"]))
+
+    if not existing:
+        _replay_children(cursor, table, row_uid)
+
+
+def _apply_delete(cursor, table: str, row_uid: str):
+    """Delete a synced row by uid, cascading like a local delete"""
+    cursor.execute(f"SELECT id FROM {table} WHERE uid = ?", (row_uid,))
+    existing = cursor.fetchone()
+    if existing is None:
+        return
+
+    for child_table, column in SYNC_CHILDREN.get(table, ()):
+        _delete_rows(cursor, child_table, f"t.{column} = ?", (existing[0],))
+
+    if table == "weekly_plans":
+        _remove_plan_items(cursor, existing[0])
+
+    cursor.execute(f"DELETE FROM {table} WHERE id = ?", (existing[0],))
+
+
+def apply_changes(peer_replica_id: str, changes):
+    """
+    Merge a peer's change_log entries (as produced by iter_changes) into
+    this database in one transaction. Entries already known here are
+    skipped; the others are appended to the local change_log and applied
+    when they are the newest entry for their row (last writer wins), so
+    every replica converges whatever the merge order. Returns the number
+    of new entries.
+    """
+    merged = 0
+    last_seq = None
+
+    with write_transaction() as cursor:
+        for (seq, op_id, table, row_uid, op, payload, created_at) in changes:
+            last_seq = seq if last_seq is None else max(last_seq, seq)
+
+            if table not in SYNC_TABLES:
+                continue
+
+            cursor.execute("SELECT 1 FROM change_log WHERE op_id = ?",
+                           (op_id,))
+            if cursor.fetchone():
+                continue
+
+            is_latest = _is_latest_change(cursor, table, row_uid, created_at,
+                                          op_id)
+
+            cursor.execute(
+                """
+                INSERT INTO change_log (
+                    op_id, replica_id, table_name, row_uid, op, payload,
+                    created_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (op_id, op_id.split(":")[0], table, row_uid, op, payload,
+                 created_at)
+            )
+            merged += 1
+
+            if is_latest:
+                if op == "delete":
+                    _apply_delete(cursor, table, row_uid)
+                else:
+                    _apply_upsert(cursor, table, row_uid, json.loads(payload))
+
+        if last_seq is not None:
+            cursor.execute(
+                """
+                INSERT INTO sync_peers (replica_id, last_seq) VALUES (?, ?)
+                ON CONFLICT (replica_id)
+                DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)
+                """,
+                (peer_replica_id, last_seq)
+            )
+
+        _maybe_compact_change_log(cursor)
+
+    return merged
+
+
+def _compact_change_log(cursor):
+    """
+    Drop change_log entries superseded by a newer entry for the same row and
+    remember the seq the log was compacted at.
+    """
+    cursor.execute(
+        """
+        DELETE FROM change_log
+        WHERE EXISTS (
+            SELECT 1 FROM change_log newer
+            WHERE newer.table_name = change_log.table_name
+              AND newer.row_uid = change_log.row_uid
+              AND (newer.created_at, newer.op_id)
+                  > (change_log.created_at, change_log.op_id)
+        )
+        """
+    )
+    removed = cursor.rowcount
+
+    cursor.execute(
+        """
+        INSERT INTO replica_meta (key, value)
+        SELECT 'compacted_seq', COALESCE(MAX(seq), 0) FROM sqlite_sequence
+        WHERE name = 'change_log'
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """
+    )
+    return removed
+
+
+def _maybe_compact_change_log(cursor):
+    """
+    Compact the change log inside the current write transaction once
+    COMPACT_EVERY_OPS entries have been appended since the last compaction.
+    """
+    cursor.execute(
+        """
+        SELECT (SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence
+                WHERE name = 'change_log')
+             - COALESCE((SELECT CAST(value AS INTEGER) FROM replica_meta
+                         WHERE key = 'compacted_seq'), 0)
+        """
+    )
+    if cursor.fetchone()[0] >= COMPACT_EVERY_OPS:
+        _compact_change_log(cursor)
+
+
+def compact_change_log():
+    """
+    Drop change_log entries superseded by a newer entry for the same row.
+    The surviving entry of each row (an upsert with its full state, or a
+    delete tombstone) is a snapshot of that row, so peers can still merge
+    from any watermark. Returns the number of removed entries.
+
+    Writes and merges already compact the log every COMPACT_EVERY_OPS
+    entries; this runs a compaction right away.
+    """
+    with write_transaction() as cursor:
+        return _compact_change_log(cursor)
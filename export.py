@@ -0,0 +1,391 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+from db import iter_weekly_plans
+
+EXPORT_COLUMNS = [
+    "plan_id",
+    "diet",
+    "plan",
+    "created_at",
+    "day",
+    "meal",
+    "food",
+    "food_category",
+    "portion",
+    "rating",
+    "mandatory"
+]
+
+# Start time (hour, minute) of a meal in calendar exports; meals not listed
+# here are spread through the day by their position in the plan
+MEAL_TIMES = {
+    "Breakfast": (8, 0),
+    "Lunch": (12, 30),
+    "Snack": (16, 0),
+    "Dinner": (19, 0)
+}
+MEAL_DURATION_MINUTES = 30
+
+
+def iter_export_rows(plans):
+    """
+    Flatten plans into one row per food, in EXPORT_COLUMNS order.
+    plans are (id, diet_id, diet_name, name, created_at, plan_data,
+    series_index) tuples as produced by db.iter_weekly_plans.
+    """
+    for plan_id, _, diet_name, plan_name, created_at, plan_data, _ in plans:
+        for day, meals in plan_data.items():
+            for meal_name, foods in meals.items():
+                for food in foods:
+                    yield [
+                        plan_id,
+                        diet_name,
+                        plan_name,
+                        created_at,
+                        day,
+                        meal_name,
+                        food['name'],
+                        food['type'],
+                        food.get('portion') or "",
+                        food.get('rating'),
+                        int(bool(food.get('mandatory')))
+                    ]
+
+
+def write_csv(plans, out):
+    """Write plans as CSV rows to a binary file object"""
+    text_out = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    writer = csv.writer(text_out)
+
+    writer.writerow(EXPORT_COLUMNS)
+    for row in iter_export_rows(plans):
+        writer.writerow(row)
+
+    text_out.flush()
+    text_out.detach()
+
+
+_XML_ILLEGAL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Plans" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_row(values):
+    """One <row> of inline-string / numeric cells"""
+    cells = []
+    for value in values:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value}</v></c>")
+        elif value is None:
+            cells.append("<c/>")
+        else:
+            text = escape(_XML_ILLEGAL_RE.sub("", str(value)))
+            cells.append(
+                f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return "<row>" + "".join(cells) + "</row>"
+
+
+def write_xlsx(plans, out):
+    """
+    Write plans as a single-sheet XLSX workbook to a binary file object.
+    The sheet XML is streamed into the zip row by row.
+    """
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr("[Content_Types].xml", _XLSX_CONTENT_TYPES)
+        workbook.writestr("_rels/.rels", _XLSX_ROOT_RELS)
+        workbook.writestr("xl/workbook.xml", _XLSX_WORKBOOK)
+        workbook.writestr("xl/_rels/workbook.xml.rels", _XLSX_WORKBOOK_RELS)
+
+        with workbook.open("xl/worksheets/sheet1.xml", "w",
+                           force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/'
+                b'spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(EXPORT_COLUMNS).encode("utf-8"))
+            for row in iter_export_rows(plans):
+                sheet.write(_xlsx_row(row).encode("utf-8"))
+            sheet.write(b"</sheetData></worksheet>")
+
+
+PDF_PAGE_WIDTH = 595  # A4 in points
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 14
+PDF_LINE_WIDTH = 90
+PDF_LINES_PER_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT
+
+
+def _iter_pdf_lines(plans):
+    """Printable text lines of plans as (text, is_heading)"""
+    for _, _, diet_name, plan_name, created_at, plan_data, _ in plans:
+        yield plan_name, True
+        yield f"{diet_name} - created {created_at}", False
+        yield "", False
+
+        for day, meals in plan_data.items():
+            yield day, True
+            for meal_name, foods in meals.items():
+                items = ", ".join(
+                    food['name'] + (f" ({food['portion']})"
+                                    if food.get('portion') else "")
+                    for food in foods
+                ) or "-"
+                text = f"  {meal_name}: {items}"
+                while len(text) > PDF_LINE_WIDTH:
+                    split_at = text.rfind(" ", 0, PDF_LINE_WIDTH)
+                    if split_at <= 2:
+                        split_at = PDF_LINE_WIDTH
+                    yield text[:split_at], False
+                    text = "      " + text[split_at:].lstrip()
+                yield text, False
+            yield "", False
+
+        yield None, False  # page break between plans
+
+
+def _pdf_text(text: str):
+    """Escape text for a PDF string literal (Latin-1 only)"""
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(plans, out):
+    """
+    Write plans as a printable text PDF to a binary file object.
+    Pages are written as soon as they are full; only object offsets are
+    kept in memory.
+    """
+    offsets = {}
+    position = 0
+
+    def write(data: bytes):
+        nonlocal position
+        out.write(data)
+        position += len(data)
+
+    def write_object(obj_id: int, body: bytes):
+        offsets[obj_id] = position
+        write(f"{obj_id} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+
+    # 1: catalog, 2: page tree (written last), 3/4: fonts
+    write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+                    b"/Encoding /WinAnsiEncoding >>")
+    write_object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold "
+                    b"/Encoding /WinAnsiEncoding >>")
+
+    page_ids = []
+    next_id = 5
+
+    def flush_page(lines):
+        nonlocal next_id
+        commands = [f"BT /F1 11 Tf {PDF_MARGIN} "
+                    f"{PDF_PAGE_HEIGHT - PDF_MARGIN} Td {PDF_LINE_HEIGHT} TL"]
+        for text, is_heading in lines:
+            font = "/F2 12 Tf" if is_heading else "/F1 11 Tf"
+            commands.append(f"{font} ({_pdf_text(text)}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1")
+
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        write_object(
+            content_id,
+            f"<< /Length {len(stream)} >>\nstream\n".encode("ascii")
+            + stream + b"\nendstream"
+        )
+        write_object(
+            page_id,
+            f"<< /Type /Page /Parent 2 0 R "
+            f"/MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> "
+            f"/Contents {content_id} 0 R >>".encode("ascii")
+        )
+        page_ids.append(page_id)
+
+    page = []
+    for text, is_heading in _iter_pdf_lines(plans):
+        if text is None or len(page) == PDF_LINES_PER_PAGE:
+            if page:
+                flush_page(page)
+            page = []
+            if text is None:
+                continue
+        page.append((text, is_heading))
+
+    if page or not page_ids:
+        flush_page(page)
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    write_object(
+        2,
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode(
+            "ascii")
+    )
+
+    xref_position = position
+    write(f"xref\n0 {next_id}\n0000000000 65535 f \n".encode("ascii"))
+    for obj_id in range(1, next_id):
+        write(f"{offsets[obj_id]:010d} 00000 n \n".encode("ascii"))
+    write(f"trailer\n<< /Size {next_id} /Root 1 0 R >>\n"
+          f"startxref\n{xref_position}\n%%EOF\n".encode("ascii"))
+
+
+def _ics_text(text: str):
+    """Escape a value for an iCalendar TEXT property"""
+    return (text.replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
+
+
+def _ics_line(line: str):
+    """Fold a content line at 75 octets, CRLF terminated"""
+    data = line.encode("utf-8")
+    chunks = []
+    while len(data) > 75:
+        cut = 75 if not chunks else 74
+        # Never split inside a multi-byte UTF-8 sequence
+        while cut > 0 and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+    chunks.append(data)
+    return b"\r\n ".join(chunks) + b"\r\n"
+
+
+def _plan_start_date(created_at: str, series_index=None):
+    """
+    Plans are placed on the calendar from the Monday after they were
+    created; week N of a multi-week plan goes N - 1 weeks later.
+    """
+    created = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
+    start = created + timedelta(days=(7 - created.weekday()) % 7 or 7)
+    return start + timedelta(weeks=(series_index or 1) - 1)
+
+
+def write_ics(plans, out):
+    """
+    Write plans as an iCalendar file to a binary file object, one event per
+    meal. Each plan starts on the Monday after its creation date, later
+    weeks of a multi-week plan follow on.
+    """
+    write = out.write
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+
+    write(_ics_line("BEGIN:VCALENDAR"))
+    write(_ics_line("VERSION:2.0"))
+    write(_ics_line("PRODID:-//Diet Automation MVP//Weekly Plans//EN"))
+    write(_ics_line("CALSCALE:GREGORIAN"))
+
+    for (plan_id, _, diet_name, plan_name, created_at, plan_data,
+         series_index) in plans:
+        start_date = _plan_start_date(created_at, series_index)
+
+        for day_offset, (day, meals) in enumerate(plan_data.items()):
+            date = start_date + timedelta(days=day_offset)
+
+            for meal_index, (meal_name, foods) in enumerate(meals.items()):
+                if not foods:
+                    continue
+
+                hour, minute = MEAL_TIMES.get(meal_name,
+                                              (7 + 3 * meal_index, 0))
+                start = datetime(date.year, date.month, date.day,
+                                 min(hour, 23), minute)
+                end = start + timedelta(minutes=MEAL_DURATION_MINUTES)
+
+                description = "\n".join(
+                    food['name'] + (f" - {food['portion']}"
+                                    if food.get('portion') else "")
+                    for food in foods
+                )
+
+                write(_ics_line("BEGIN:VEVENT"))
+                write(_ics_line(
+                    f"UID:plan{plan_id}-{date:%Y%m%d}-{meal_index}"
+                    f"@diet-automation"))
+                write(_ics_line(f"DTSTAMP:{stamp}"))
+                write(_ics_line(f"DTSTART:{start:%Y%m%dT%H%M%S}"))
+                write(_ics_line(f"DTEND:{end:%Y%m%dT%H%M%S}"))
+                write(_ics_line(
+                    f"SUMMARY:{_ics_text(f'{meal_name} - {plan_name}')}"))
+                write(_ics_line(f"DESCRIPTION:{_ics_text(description)}"))
+                write(_ics_line(f"CATEGORIES:{_ics_text(diet_name)}"))
+                write(_ics_line("END:VEVENT"))
+
+    write(_ics_line("END:VCALENDAR"))
+
+
+# format -> (writer, file extension, MIME type)
+EXPORT_FORMATS = {
+    "csv": (write_csv, "csv", "text/csv"),
+    "xlsx": (write_xlsx, "xlsx",
+             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "pdf": (write_pdf, "pdf", "application/pdf"),
+    "ics": (write_ics, "ics", "text/calendar")
+}
+
+
+def export_plans(export_format: str, out, plan_ids=None, diet_ids=None):
+    """
+    Stream saved plans straight from the database into an export.
+
+    out is a file path or a binary file object (e.g. an io.BytesIO download
+    buffer). Plans are read and written one at a time, so memory use does
+    not grow with the number of exported plans.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    writer = EXPORT_FORMATS[export_format][0]
+    plans = iter_weekly_plans(plan_ids=plan_ids, diet_ids=diet_ids)
+
+    if isinstance(out, str):
+        with open(out, "wb") as f:
+            writer(plans, f)
+    else:
+        writer(plans, out)
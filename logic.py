@@ -0,0 +1,214 @@
+import bisect
+import random
+from itertools import accumulate
+
+from db import (
+    get_foods_by_category,
+    get_food_recency_scores,
+    RECENCY_HALF_LIFE_DAYS
+)
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday",
+        "Sunday"]
+
+# How strongly recently served foods are pushed back in "recency" weighting
+RECENCY_STRENGTH = 1.0
+
+# Share of a food's variety score left after one week
+WEEKLY_DECAY = 0.5 ** (7 / RECENCY_HALF_LIFE_DAYS)
+
+
+def food_weight(rating, recency_score=0.0):
+    """
+    Sampling weight of an optional food.
+    rating^2 gives more preference to high ratings; a recently served food
+    (higher recency score) is down-weighted by 1 / (1 + strength * score).
+    """
+    return rating ** 2 / (1 + RECENCY_STRENGTH * recency_score)
+
+
+def random_choice_engine(candidates, weights):
+    """
+    Default selection engine: one candidate drawn with probability
+    weight / sum(weights).
+
+    An engine is any callable (candidates, weights) -> candidate; alternate
+    implementations (cached, vectorized, alias tables, ...) can be passed to
+    generate_weekly_plan / iter_plan_horizon and must keep this distribution.
+    """
+    return random.choices(candidates, weights=weights, k=1)[0]
+
+
+def cumulative_weights_engine(candidates, weights):
+    """
+    Alternate selection engine: inverse transform sampling by bisecting the
+    cumulative weights with one uniform draw. Same distribution as
+    random_choice_engine.
+    """
+    cumulative = list(accumulate(weights))
+    index = bisect.bisect_right(cumulative, random.random() * cumulative[-1])
+    return candidates[min(index, len(candidates) - 1)]
+
+
+def selection_probabilities(type_foods, cat_name=None, variety=None):
+    """
+    Exact probability of each optional food of one food type being picked
+    by an engine, i.e. weight / sum(weights) with the same weights the
+    generator uses. Returns {food name: probability}.
+    """
+    variety = variety or {}
+    weights = [food_weight(f[4], variety.get((cat_name, f[1]), 0.0))
+               for f in type_foods]
+    total = sum(weights)
+    return {f[1]: weight / total for f, weight in zip(type_foods, weights)}
+
+
+def _food_entry(food, mandatory):
+    return {
+        'name': food[1],
+        'type': food[2],
+        'portion': food[3],
+        'rating': food[4],
+        'mandatory': mandatory
+    }
+
+
+def _load_meal_foods(meal_categories):
+    """
+    Load and group the foods of every meal category once:
+    [(cat_name, mandatory_foods, {food_type: optional_foods})]
+    """
+    meal_foods = []
+
+    for cat_id, cat_name, _ in meal_categories:
+        foods = get_foods_by_category(cat_id)
+
+        # Separate mandatory and optional foods
+        mandatory_foods = [f for f in foods if f[5] == 1]  # f[5] is mandatory
+
+        # Group optional foods by food category type
+        foods_by_type = {}
+        for food in foods:
+            if food[5] == 0:
+                foods_by_type.setdefault(food[2], []).append(food)  # food_type
+
+        meal_foods.append((cat_name, mandatory_foods, foods_by_type))
+
+    return meal_foods
+
+
+def _generate_day(meal_foods, variety, engine):
+    """Pick the foods of one day; variety holds (meal, food) recency scores"""
+    day_plan = {}
+
+    for cat_name, mandatory_foods, foods_by_type in meal_foods:
+        # Always include mandatory foods
+        selected_foods = [_food_entry(f, True) for f in mandatory_foods]
+
+        # Select at least one food from each food category type
+        for type_foods in foods_by_type.values():
+            weights = [
+                food_weight(f[4], variety.get((cat_name, f[1]), 0.0))
+                for f in type_foods  # f[4] is rating
+            ]
+            selected = engine(type_foods, weights)
+            selected_foods.append(_food_entry(selected, False))
+
+        day_plan[cat_name] = selected_foods
+
+    return day_plan
+
+
+def iter_plan_horizon(diet_id, meal_categories, days=None, weeks=None,
+                      weighting="rating", engine=random_choice_engine):
+    """
+    Lazily generate a plan over a horizon of N days or N weeks, yielding one
+    week (weekday -> meal -> foods) at a time; a trailing partial week only
+    has its first days.
+
+    Foods served in earlier weeks of the horizon are down-weighted in later
+    weeks by a decaying variety score, so consecutive weeks differ. With
+    weighting="recency" the score starts from the diet's saved plan history.
+    Foods are loaded once, so cost is linear in the horizon length.
+    engine picks one food per food type (see random_choice_engine).
+    """
+    if weighting not in ("rating", "recency"):
+        raise ValueError(f"Unknown weighting: {weighting}")
+
+    if days is None:
+        days = 7 * (weeks if weeks is not None else 1)
+
+    meal_foods = _load_meal_foods(meal_categories)
+    variety = get_food_recency_scores(diet_id) if weighting == "recency" else {}
+
+    for week_start in range(0, days, 7):
+        week_plan = {}
+
+        for day in DAYS[:min(7, days - week_start)]:
+            week_plan[day] = _generate_day(meal_foods, variety, engine)
+
+        # Carry the week's servings into the next weeks' variety scores
+        variety = {key: score * WEEKLY_DECAY for key, score in variety.items()}
+        for day_plan in week_plan.values():
+            for cat_name, foods in day_plan.items():
+                for food in foods:
+                    if not food['mandatory']:
+                        key = (cat_name, food['name'])
+                        variety[key] = variety.get(key, 0.0) + 1
+
+        yield week_plan
+
+
+def generate_weekly_plan(diet_id, meal_categories, weighting="rating",
+                         engine=random_choice_engine):
+    """
+    Generate a 7-day meal plan.
+
+    weighting="rating" weights optional foods by rating^2 only;
+    weighting="recency" also down-weights foods served in recently saved
+    plans of the diet.
+    """
+    return next(iter_plan_horizon(diet_id, meal_categories, weeks=1,
+                                  weighting=weighting, engine=engine))
+
+
+def check_plan_invariants(plan, meal_categories):
+    """
+    Structural guarantees every engine must keep. Returns a list of
+    violations (empty when the plan is valid):
+    - every mandatory food of a meal is in it every day, marked mandatory
+    - exactly one optional food per food type of the meal, taken from
+      that meal's foods of that type
+    - no optional food of a type the meal does not have
+    """
+    meal_foods = _load_meal_foods(meal_categories)
+    problems = []
+
+    for day, day_plan in plan.items():
+        for cat_name, mandatory_foods, foods_by_type in meal_foods:
+            foods = day_plan.get(cat_name, [])
+
+            served_mandatory = [f['name'] for f in foods if f['mandatory']]
+            expected_mandatory = [f[1] for f in mandatory_foods]
+            if sorted(served_mandatory) != sorted(expected_mandatory):
+                problems.append(
+                    f"{day}/{cat_name}: mandatory foods {served_mandatory}, "
+                    f"expected {expected_mandatory}")
+
+            optional = [f for f in foods if not f['mandatory']]
+            for food_type, type_foods in foods_by_type.items():
+                picked = [f for f in optional if f['type'] == food_type]
+                names = {f[1] for f in type_foods}
+                if len(picked) != 1 or picked[0]['name'] not in names:
+                    problems.append(
+                        f"{day}/{cat_name}: picks for {food_type} "
+                        f"{[f['name'] for f in picked]}, expected one of "
+                        f"{sorted(names)}")
+
+            unknown_types = {f['type'] for f in optional} - set(foods_by_type)
+            if unknown_types:
+                problems.append(
+                    f"{day}/{cat_name}: foods of unexpected types "
+                    f"{sorted(unknown_types)}")
+
+    return problems
@@ -0,0 +1,199 @@
+import re
+
+from db import iter_plan_item_portions
+
+# Unit aliases -> (normalized unit, factor to the normalized unit).
+# Mass is summed in grams, volume in millilitres.
+UNIT_CONVERSIONS = {
+    "g": ("g", 1),
+    "gr": ("g", 1),
+    "gram": ("g", 1),
+    "grams": ("g", 1),
+    "kg": ("g", 1000),
+    "mg": ("g", 0.001),
+    "oz": ("g", 28.35),
+    "lb": ("g", 453.6),
+    "lbs": ("g", 453.6),
+    "ml": ("ml", 1),
+    "cl": ("ml", 10),
+    "dl": ("ml", 100),
+    "l": ("ml", 1000),
+    "liter": ("ml", 1000),
+    "liters": ("ml", 1000),
+    "litre": ("ml", 1000),
+    "litres": ("ml", 1000),
+    "cup": ("ml", 240),
+    "cups": ("ml", 240),
+    "tbsp": ("ml", 15),
+    "tablespoon": ("ml", 15),
+    "tablespoons": ("ml", 15),
+    "tsp": ("ml", 5),
+    "teaspoon": ("ml", 5),
+    "teaspoons": ("ml", 5)
+}
+
+# Count units that are really the same thing
+COUNT_UNIT_ALIASES = {
+    "": "unit",
+    "u": "unit",
+    "un": "unit",
+    "pc": "unit",
+    "pcs": "unit",
+    "piece": "unit",
+    "x": "unit"
+}
+
+# Plurals not formed by a plain "s" / "es" ending
+IRREGULAR_PLURALS = {
+    "leaves": "leaf",
+    "loaves": "loaf",
+    "halves": "half",
+    "knives": "knife",
+    "teeth": "tooth"
+}
+
+# Endings pluralized with "es" ("glasses", "tomatoes", "pinches", ...)
+_ES_PLURAL_ENDINGS = ("sses", "shes", "ches", "xes", "zes", "oes")
+
+_PORTION_RE = re.compile(
+    r"^\s*(\d+\s+\d+\s*/\s*\d+|\d+\s*/\s*\d+|\d+(?:[.,]\d+)?)\s*([^\W\d_]*)",
+    re.UNICODE
+)
+
+
+def _parse_quantity(text: str):
+    """'1 1/2' -> 1.5, '1/2' -> 0.5, '1,5' -> 1.5"""
+    text = re.sub(r"\s*/\s*", "/", text)
+    total = 0.0
+    for part in text.split():
+        if "/" in part:
+            num, den = part.split("/")
+            total += int(num) / int(den) if int(den) else 0
+        else:
+            total += float(part.replace(",", "."))
+    return total
+
+
+def _singular(unit: str):
+    """'slices' -> 'slice', 'glasses' -> 'glass', 'berries' -> 'berry'"""
+    if unit in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[unit]
+    if len(unit) <= 2 or not unit.endswith("s") or unit.endswith(("ss", "us")):
+        return unit
+    if unit.endswith("ies") and len(unit) > 4:
+        return unit[:-3] + "y"
+    if unit.endswith(_ES_PLURAL_ENDINGS):
+        return unit[:-2]
+    return unit[:-1]
+
+
+def parse_portion(portion: str):
+    """
+    Parse a free-text portion like "30g", "1 1/2 cups" or "2 slices".
+
+    Returns (quantity, unit) with mass in "g", volume in "ml" and anything
+    else as a singular count unit ("slice", "unit", ...), or None when the
+    portion has no leading quantity.
+    """
+    if not portion:
+        return None
+
+    match = _PORTION_RE.match(portion)
+    if not match:
+        return None
+
+    quantity = _parse_quantity(match.group(1))
+    unit = match.group(2).lower()
+
+    if unit in UNIT_CONVERSIONS:
+        unit, factor = UNIT_CONVERSIONS[unit]
+        return quantity * factor, unit
+
+    unit = _singular(unit)
+    return quantity, COUNT_UNIT_ALIASES.get(unit, unit)
+
+
+def _add_servings(totals: dict, food_name: str, food_type: str, portion,
+                  servings: int):
+    """Accumulate servings of one food/portion into totals"""
+    parsed = parse_portion(portion)
+
+    if parsed is None:
+        # Unparseable portions are kept as-is and only counted
+        quantity, unit = None, (portion or "").strip()
+    else:
+        quantity, unit = parsed
+        quantity *= servings
+
+    key = (food_type, food_name, unit)
+    if key not in totals:
+        totals[key] = [None, 0]
+    if quantity is not None:
+        totals[key][0] = (totals[key][0] or 0) + quantity
+    totals[key][1] += servings
+
+
+def _shopping_rows(totals: dict):
+    """Turn accumulated totals into sorted shopping list rows"""
+    return [
+        {
+            "food": food_name,
+            "category": food_type,
+            "quantity": round(quantity, 2) if quantity is not None else None,
+            "unit": unit,
+            "servings": servings
+        }
+        for (food_type, food_name, unit), (quantity, servings)
+        in sorted(totals.items())
+    ]
+
+
+def aggregate_plans(plans):
+    """
+    Shopping list for an iterable of plan dicts (day -> meal -> foods), such
+    as st.session_state.current_plan. Plans are consumed one at a time, so
+    a generator of plans is never held in memory at once.
+    """
+    totals = {}
+
+    for plan in plans:
+        for meals in plan.values():
+            for foods in meals.values():
+                for food in foods:
+                    _add_servings(totals, food['name'], food['type'],
+                                  food.get('portion'), 1)
+
+    return _shopping_rows(totals)
+
+
+def aggregate_saved_plans(plan_ids=None, diet_ids=None):
+    """
+    Shopping list over saved plans, selected by plan id and/or diet id.
+    Uses the normalized plan_items rows grouped by food and portion, so no
+    plan_data JSON is loaded.
+    """
+    totals = {}
+
+    for food_name, food_type, portion, servings in iter_plan_item_portions(
+            plan_ids=plan_ids, diet_ids=diet_ids):
+        _add_servings(totals, food_name, food_type, portion, servings)
+
+    return _shopping_rows(totals)
+
+
+def totals_by_category(rows):
+    """Sum a shopping list per food category and unit"""
+    totals = {}
+
+    for row in rows:
+        key = (row["category"], row["unit"] if row["quantity"] is not None
+               else None)
+        if key not in totals:
+            totals[key] = {"category": row["category"], "unit": key[1],
+                           "quantity": 0 if key[1] else None, "servings": 0}
+        if row["quantity"] is not None:
+            totals[key]["quantity"] = round(
+                totals[key]["quantity"] + row["quantity"], 2)
+        totals[key]["servings"] += row["servings"]
+
+    return list(totals.values())
@@ -0,0 +1,66 @@
+import sqlite3
+import uuid
+
+import db
+from tenancy import use_database
+
+
+def pull_changes(remote_path: str):
+    """
+    Merge into the active database every change of the replica at
+    remote_path made since the last pull. Only the remote log entries after
+    the stored watermark are read. Returns the number of merged entries.
+    """
+    with use_database(remote_path):
+        remote_id = db.get_replica_id()
+
+    since_seq = db.get_peer_watermark(remote_id)
+
+    with use_database(remote_path):
+        changes = db.iter_changes(since_seq)
+    return db.apply_changes(remote_id, changes)
+
+
+def sync_replicas(path_a: str, path_b: str):
+    """
+    Two-way merge of two replica files; afterwards both hold the same rows.
+    Returns (entries merged into a, entries merged into b).
+    """
+    with use_database(path_a):
+        merged_a = pull_changes(path_b)
+    with use_database(path_b):
+        merged_b = pull_changes(path_a)
+    return merged_a, merged_b
+
+
+def clone_replica(source_path: str, target_path: str):
+    """
+    Start a new replica as a copy of source_path, e.g. for a new device.
+    The copy gets its own replica id and is marked as having merged all of
+    the source's changes so far.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    source.backup(target)
+    source.close()
+
+    source_id = target.execute(
+        "SELECT value FROM replica_meta WHERE key = 'replica_id'"
+    ).fetchone()[0]
+    last_seq = target.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM change_log"
+    ).fetchone()[0]
+
+    target.execute(
+        "UPDATE replica_meta SET value = ? WHERE key = 'replica_id'",
+        (uuid.uuid4().hex,)
+    )
+    target.execute(
+        """
+        INSERT INTO sync_peers (replica_id, last_seq) VALUES (?, ?)
+        ON CONFLICT (replica_id) DO UPDATE SET last_seq = excluded.last_seq
+        """,
+        (source_id, last_seq)
+    )
+    target.commit()
+    target.close()
@@ -0,0 +1,293 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import db
+
+TENANT_DIR = "data/tenants"
+CATALOG_PATH = "data/catalog.db"
+
+# Shards kept open at most; the least recently used idle one is closed
+# when a new shard is opened beyond this
+MAX_OPEN_SHARDS = 32
+
+# Idle connections kept per open shard for reuse
+MAX_IDLE_CONNECTIONS = 4
+
+
+def shard_path(user_id: str, tenant_dir: str = TENANT_DIR):
+    """File of a user's shard; readable name plus a hash against collisions"""
+    safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", user_id)[:40]
+    digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(tenant_dir, f"{safe_name}-{digest}.db")
+
+
+def _file_uri(path: str, mode: str = None):
+    uri = "file:" + quote(os.path.abspath(path))
+    return f"{uri}?mode={mode}" if mode else uri
+
+
+class _Shard:
+    """An open shard: its idle connections and the number of leased ones"""
+
+    def __init__(self):
+        self.idle = []
+        self.leases = 0
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+class _LeasedConnection:
+    """
+    A pooled shard connection handed out by get_connection(), used by one
+    caller at a time. close() rolls back anything left uncommitted and
+    returns the connection to the pool instead of closing it.
+    """
+
+    def __init__(self, pool, shard, conn):
+        self._pool = pool
+        self._shard = shard
+        self._conn = conn
+        self._released = False
+
+    @property
+    def isolation_level(self):
+        return self._conn.isolation_level
+
+    @isolation_level.setter
+    def isolation_level(self, value):
+        self._conn.isolation_level = value
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        if self._conn.in_transaction:
+            self._conn.rollback()
+        self._pool._release(self._shard, self._conn)
+
+
+class ShardPool:
+    """
+    Routes each user to their own SQLite shard and keeps shard connections
+    open in an LRU cache. Writers of different users never share a file
+    lock. Every lease gets a connection of its own, so a long read (e.g. a
+    streaming export) never blocks other sessions of the same user; writers
+    of one shard are coordinated by SQLite's WAL locking.
+
+    Every shard connection has the shared catalog database attached
+    read-only as schema "catalog".
+    """
+
+    def __init__(self, tenant_dir: str = TENANT_DIR,
+                 catalog_path: str = CATALOG_PATH,
+                 max_open: int = MAX_OPEN_SHARDS):
+        self.tenant_dir = tenant_dir
+        self.catalog_path = catalog_path
+        self.max_open = max_open
+
+        self._shards = OrderedDict()  # user_id -> _Shard
+        self._initialized = set()
+        self._pool_lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+
+        os.makedirs(tenant_dir, exist_ok=True)
+        if not os.path.exists(catalog_path):
+            with use_database(catalog_path):
+                db.create_tables()
+
+            # Read-only attachment cannot recover a WAL database
+            conn = sqlite3.connect(catalog_path)
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.close()
+
+    def _open(self, user_id: str):
+        conn = sqlite3.connect(
+            _file_uri(shard_path(user_id, self.tenant_dir)),
+            uri=True,
+            timeout=db.BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False
+        )
+        conn.isolation_level = None
+        conn.execute("ATTACH DATABASE ? AS catalog",
+                     (_file_uri(self.catalog_path, "ro"),))
+        return conn
+
+    def _evict(self, keep: str = None):
+        """Close least recently used shards that are not leased"""
+        for user_id in list(self._shards):
+            if len(self._shards) <= self.max_open:
+                return
+            shard = self._shards[user_id]
+            if user_id != keep and shard.leases == 0:
+                shard.close()
+                del self._shards[user_id]
+
+    def connection(self, user_id: str):
+        """Lease a connection to the user's shard; close() hands it back"""
+        with self._pool_lock:
+            if user_id in self._shards:
+                self._shards.move_to_end(user_id)
+            else:
+                self._shards[user_id] = _Shard()
+                self._evict(keep=user_id)
+            shard = self._shards[user_id]
+            shard.leases += 1
+            conn = shard.idle.pop() if shard.idle else None
+
+        if conn is None:
+            try:
+                conn = self._open(user_id)
+            except BaseException:
+                self._release(shard, None)
+                raise
+
+        return _LeasedConnection(self, shard, conn)
+
+    def _release(self, shard, conn):
+        with self._pool_lock:
+            shard.leases -= 1
+            if conn is not None:
+                if (len(shard.idle) < MAX_IDLE_CONNECTIONS
+                        and shard in self._shards.values()):
+                    shard.idle.append(conn)
+                else:
+                    conn.close()
+            # Shards that were busy when the limit was exceeded
+            self._evict()
+
+    def ensure_schema(self, user_id: str):
+        """Create the tables of a user's shard once per process"""
+        with self._schema_lock:
+            if user_id in self._initialized:
+                return
+
+            token = db.CONNECTION_FACTORY.set(
+                lambda: self.connection(user_id))
+            try:
+                db.create_tables()
+            finally:
+                db.CONNECTION_FACTORY.reset(token)
+
+            self._initialized.add(user_id)
+
+    def open_shards(self):
+        """User ids with an open connection, least recently used first"""
+        with self._pool_lock:
+            return list(self._shards)
+
+    def close_all(self):
+        """Close every idle shard connection"""
+        with self._pool_lock:
+            for user_id, shard in list(self._shards.items()):
+                if shard.leases == 0:
+                    shard.close()
+                    del self._shards[user_id]
+
+
+_pool = None
+_pool_init_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide shard pool"""
+    global _pool
+    with _pool_init_lock:
+        if _pool is None:
+            _pool = ShardPool()
+        return _pool
+
+
+def activate_tenant(user_id):
+    """
+    Route all db.py calls of the current thread/context to the user's shard,
+    or back to the single default database when user_id is empty.
+    """
+    if not user_id:
+        db.CONNECTION_FACTORY.set(None)
+        return
+
+    pool = get_pool()
+    pool.ensure_schema(user_id)
+    db.CONNECTION_FACTORY.set(lambda: pool.connection(user_id))
+
+
+@contextmanager
+def use_tenant(user_id: str):
+    """Route db.py calls inside the block to the user's shard"""
+    pool = get_pool()
+    pool.ensure_schema(user_id)
+    token = db.CONNECTION_FACTORY.set(lambda: pool.connection(user_id))
+    try:
+        yield
+    finally:
+        db.CONNECTION_FACTORY.reset(token)
+
+
+def run_as_tenant(user_id, action, *args, **kwargs):
+    """
+    Call action(*args, **kwargs) with db.py routed to the user's shard, or
+    to the default database when user_id is empty, whatever the calling
+    thread/context has active. For UI callbacks, which run before the
+    script body calls activate_tenant.
+    """
+    if not user_id:
+        token = db.CONNECTION_FACTORY.set(None)
+        try:
+            return action(*args, **kwargs)
+        finally:
+            db.CONNECTION_FACTORY.reset(token)
+
+    with use_tenant(user_id):
+        return action(*args, **kwargs)
+
+
+@contextmanager
+def use_database(path: str):
+    """
+    Route db.py calls inside the block to a plain database file, e.g. the
+    catalog path to maintain template diets:
+
+        with use_database(CATALOG_PATH):
+            db.add_diet("Mediterranean")
+            diet_id = max(diet_id for diet_id, _ in db.get_diets())
+            db.add_meal_category(diet_id, "Breakfast")
+            ...
+
+    Every tenant sees the catalog's diets as templates (get_catalog_diets,
+    instantiate_template).
+    """
+    token = db.CONNECTION_FACTORY.set(
+        lambda: sqlite3.connect(path, timeout=db.BUSY_TIMEOUT_SECONDS))
+    try:
+        yield
+    finally:
+        db.CONNECTION_FACTORY.reset(token)
+
+
+def get_catalog_diets():
+    """Template diets of the shared catalog (requires an active tenant)"""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT id, name FROM catalog.diets ORDER BY name")
+
+    diets = cursor.fetchall()
+    conn.close()
+    return diets
+
+
+def instantiate_template(template_diet_id: int, name: str):
+    """Copy a catalog template diet into the active tenant's shard"""
+    return db.clone_diet(template_diet_id, name, source_schema="catalog")
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def pytest_addoption(parser):
+    parser.addoption("--run-slow", action="store_true", default=False,
+                     help="also run tests marked slow")
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "slow: long-running test, only run with --run-slow")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-slow"):
+        return
+    skip_slow = pytest.mark.skip(reason="needs --run-slow")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """A fresh database file used by every db.py call of the test"""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "diet_app.db"))
+    token = db.CONNECTION_FACTORY.set(None)
+    db.create_tables()
+    yield db.DB_PATH
+    db.CONNECTION_FACTORY.reset(token)
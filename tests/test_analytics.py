@@ -0,0 +1,98 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import db
+import logic
+
+
+def _recompute(diet_id):
+    """The analytics queries' results computed from the saved plans"""
+    food_totals, meal_totals, ratings = Counter(), Counter(), Counter()
+    week_plans, week_foods = Counter(), {}
+
+    for (_, _, _, _, created_at, plan_data,
+         series_index) in db.iter_weekly_plans(diet_ids=[diet_id]):
+        week = db._plan_week(db._plan_date(created_at, series_index))
+        week_plans[week] += 1
+        foods = week_foods.setdefault(week, Counter())
+
+        for _, meal_name, food in db._iter_plan_foods(plan_data):
+            food_totals[(food['name'], food['type'])] += 1
+            meal_totals[(meal_name, food['name'])] += 1
+            ratings[food['rating']] += 1
+            foods[food['name']] += 1
+
+    return {
+        "food_frequency": sorted(
+            ((name, food_type, total)
+             for (name, food_type), total in food_totals.items()),
+            key=lambda row: (-row[2], row[0])),
+        "meal_food_frequency": sorted(
+            ((meal, name, total) for (meal, name), total in meal_totals.items()),
+            key=lambda row: (row[0], -row[2], row[1])),
+        "rating_distribution": sorted(ratings.items()),
+        "weekly_variety": [
+            (week, week_plans[week], len(week_foods[week]),
+             sum(week_foods[week].values()))
+            for week in sorted(week_plans, reverse=True)
+        ]
+    }
+
+
+def _aggregates(diet_id):
+    return {
+        "food_frequency": db.get_food_frequency(diet_id),
+        "meal_food_frequency": db.get_meal_food_frequency(diet_id),
+        "rating_distribution": db.get_rating_distribution(diet_id),
+        "weekly_variety": db.get_weekly_variety(diet_id)
+    }
+
+
+def test_aggregates_match_the_saved_plans_after_saves_and_deletes(temp_db):
+    random.seed(11)
+    db.add_diet("Analytics")
+    db.add_meal_category(1, "Breakfast")
+    db.add_meal_category(1, "Lunch")
+    breakfast, lunch = [cat_id for cat_id, _, _ in db.get_meal_categories(1)]
+    for meal_id, name, food_type, rating, mandatory in [
+            (breakfast, "Coffee", "Drinks", 3, 1),
+            (breakfast, "Apple", "Fruits", 5, 0),
+            (breakfast, "Kiwi", "Fruits", 1, 0),
+            (breakfast, "Egg", "Proteins", 4, 0),
+            (lunch, "Rice", "Carbohydrates", 5, 0),
+            (lunch, "Bread", "Carbohydrates", 2, 0),
+            (lunch, "Chicken", "Proteins", 5, 0),
+            (lunch, "Egg", "Proteins", 3, 0)]:
+        db.add_food(1, meal_id, name, food_type, "1", rating, mandatory)
+    categories = db.get_meal_categories(1)
+
+    now = datetime.now()
+    plan_ids = []
+    with db.write_transaction() as cursor:
+        for days_ago in (40, 33, 30, 21, 9, 8, 2):
+            created_at = (now - timedelta(days=days_ago)).strftime(
+                "%Y-%m-%d %H:%M:%S")
+            plan_ids.append(db._insert_weekly_plan(
+                cursor, 1, f"{days_ago} days ago", created_at,
+                logic.generate_weekly_plan(1, categories)))
+    plan_ids.append(db.save_weekly_plan(
+        1, "Today", logic.generate_weekly_plan(1, categories)))
+    kept_series = db.save_plan_series(
+        1, "Kept", logic.iter_plan_horizon(1, categories, weeks=3))
+    dropped_series = db.save_plan_series(
+        1, "Dropped", logic.iter_plan_horizon(1, categories, weeks=2))
+
+    assert _aggregates(1) == _recompute(1)
+
+    for plan_id in (plan_ids.pop(1), plan_ids.pop(3), plan_ids.pop()):
+        db.delete_weekly_plan(plan_id)
+    db.delete_plan_series(dropped_series)
+    assert _aggregates(1) == _recompute(1)
+
+    db.save_weekly_plan(1, "Again", logic.generate_weekly_plan(1, categories))
+    db.delete_plan_series(kept_series)
+    for plan_id in plan_ids:
+        db.delete_weekly_plan(plan_id)
+    assert _aggregates(1) == _recompute(1)
+    assert len(_recompute(1)["weekly_variety"]) == 1
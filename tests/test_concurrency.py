@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+
+import pytest
+
+import db
+
+THREADS = 16
+OPS_PER_THREAD = 100
+
+
+@pytest.fixture
+def diet(temp_db):
+    db.add_diet("Stress")
+    diet_id = db.get_diets()[0][0]
+    for i in range(5):
+        db.add_meal_category(diet_id, f"Meal {i}")
+    return diet_id
+
+
+def _worker(diet_id, seed, results, errors):
+    rng = random.Random(seed)
+    ops = conflicts = 0
+
+    for _ in range(OPS_PER_THREAD):
+        try:
+            categories = db.get_meal_categories(diet_id)
+            roll = rng.random()
+
+            if roll < 0.3 or not categories:
+                db.add_meal_category(diet_id, "Extra")
+            else:
+                cat_id = rng.choice(categories)[0]
+                version = db.get_row_version("meal_categories", cat_id)
+                try:
+                    if roll < 0.8:
+                        db.move_meal_category(cat_id, rng.choice(["up", "down"]),
+                                              expected_version=version)
+                    else:
+                        db.delete_meal_category(cat_id,
+                                                expected_version=version)
+                except db.ConcurrentModificationError:
+                    conflicts += 1
+            ops += 1
+        except Exception as e:  # any other error fails the test
+            errors.append(repr(e))
+
+    results.append((ops, conflicts))
+
+
+def test_concurrent_add_move_delete_keeps_order_unique(diet, record_property):
+    results = []
+    errors = []
+    threads = [
+        threading.Thread(target=_worker, args=(diet, seed, results, errors))
+        for seed in range(THREADS)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ops = sum(done for done, _ in results)
+    record_property("ops_per_second", round(ops / elapsed))
+    record_property("version_conflicts", sum(c for _, c in results))
+
+    assert errors == []
+    assert ops == THREADS * OPS_PER_THREAD
+
+    order = [index for _, _, index in db.get_meal_categories(diet)]
+    assert len(order) == len(set(order))
+
+
+def test_stale_version_is_rejected(diet):
+    cat_id = db.get_meal_categories(diet)[0][0]
+    version = db.get_row_version("meal_categories", cat_id)
+
+    db.move_meal_category(cat_id, "down", expected_version=version)
+
+    with pytest.raises(db.ConcurrentModificationError):
+        db.delete_meal_category(cat_id, expected_version=version)
+    assert db.get_row_versions("meal_categories", [cat_id]) == {
+        cat_id: version + 1}
+
+
+def test_rename_with_stale_version_keeps_newer_name(diet):
+    plan_id = db.save_weekly_plan(diet, "Plan", {"Monday": {}})
+    version = db.get_row_version("weekly_plans", plan_id)
+
+    db.update_weekly_plan_name(plan_id, "First", expected_version=version)
+    with pytest.raises(db.ConcurrentModificationError):
+        db.update_weekly_plan_name(plan_id, "Second",
+                                   expected_version=version)
+
+    assert db.get_weekly_plans(diet)[0][1] == "First"
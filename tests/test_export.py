@@ -0,0 +1,151 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import date
+from xml.etree import ElementTree
+
+import db
+import export
+import logic
+
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def _plan(plan_id=1, name="Week 1", created_at="2024-03-06 10:00:00",
+          plan_data=None, series_index=None, diet_name="Diet"):
+    if plan_data is None:
+        plan_data = {
+            "Monday": {
+                "Breakfast": [{"name": "Egg", "type": "Proteins",
+                               "portion": "2", "rating": 5,
+                               "mandatory": True}],
+                "Lunch": [{"name": "Rice", "type": "Carbs", "portion": "",
+                           "rating": 3, "mandatory": False}]
+            }
+        }
+    return (plan_id, 1, diet_name, name, created_at, plan_data, series_index)
+
+
+def _write(writer, plans):
+    out = io.BytesIO()
+    writer(plans, out)
+    return out.getvalue()
+
+
+def test_csv_round_trip():
+    data = _write(export.write_csv, [_plan(name='Comma, "quoted"\nplan')])
+
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+    assert rows[0] == export.EXPORT_COLUMNS
+    assert rows[1:] == [
+        ["1", "Diet", 'Comma, "quoted"\nplan', "2024-03-06 10:00:00",
+         "Monday", "Breakfast", "Egg", "Proteins", "2", "5", "1"],
+        ["1", "Diet", 'Comma, "quoted"\nplan', "2024-03-06 10:00:00",
+         "Monday", "Lunch", "Rice", "Carbs", "", "3", "0"]
+    ]
+
+
+def test_xlsx_sheet_escapes_markup_and_control_characters():
+    data = _write(export.write_xlsx,
+                  [_plan(name="Fish & <Chips>\x01\x1f ok", diet_name="A\tB")])
+
+    with zipfile.ZipFile(io.BytesIO(data)) as workbook:
+        assert workbook.testzip() is None
+        root = ElementTree.fromstring(workbook.read("xl/worksheets/sheet1.xml"))
+
+    rows = []
+    for row in root.iter(f"{SHEET_NS}row"):
+        values = []
+        for cell in row.findall(f"{SHEET_NS}c"):
+            text = cell.find(f"{SHEET_NS}is/{SHEET_NS}t")
+            number = cell.find(f"{SHEET_NS}v")
+            if text is not None:
+                values.append(text.text or "")
+            elif number is not None:
+                values.append(int(number.text))
+            else:
+                values.append(None)
+        rows.append(values)
+
+    assert rows[0] == export.EXPORT_COLUMNS
+    assert rows[1] == [1, "A\tB", "Fish & <Chips> ok", "2024-03-06 10:00:00",
+                       "Monday", "Breakfast", "Egg", "Proteins", "2", 5, 1]
+    assert rows[2][7:] == ["Carbs", "", 3, 0]
+
+
+def test_pdf_xref_offsets_and_page_count():
+    days = {
+        f"Day {n}": {"Breakfast": [{"name": f"Food {n}-{i}", "type": "Carbs",
+                                    "portion": "1"} for i in range(30)]}
+        for n in range(40)
+    }
+    plans = [_plan(1, plan_data=days), _plan(2, name="Short")]
+    data = _write(export.write_pdf, plans)
+
+    assert data.startswith(b"%PDF-1.4\n")
+    assert data.endswith(b"%%EOF\n")
+
+    xref_position = int(re.search(rb"startxref\n(\d+)\n", data).group(1))
+    assert data[xref_position:].startswith(b"xref\n")
+
+    xref = data[xref_position:].split(b"trailer")[0].splitlines()
+    first_id, count = map(int, xref[1].split())
+    entries = xref[2:2 + count]
+    assert first_id == 0 and len(entries) == count
+    assert re.search(rf"/Size {count} ".encode(), data)
+
+    for obj_id, entry in enumerate(entries[1:], start=1):
+        offset = int(entry[:10])
+        assert data[offset:].startswith(f"{obj_id} 0 obj\n".encode())
+
+    # The long plan runs over several pages and the next plan starts afresh
+    page_count = len(re.findall(rb"/Type /Page ", data))
+    long_plan_lines = len(list(export._iter_pdf_lines(plans[:1]))) - 1
+    expected = -(-long_plan_lines // export.PDF_LINES_PER_PAGE) + 1
+    assert page_count == expected > 2
+    assert re.search(rf"/Count {page_count} ".encode(), data)
+
+
+def test_ics_folds_multibyte_lines_at_75_octets():
+    foods = [{"name": "Crème brûlée " * 4 + "🍮", "type": "Sweets",
+              "portion": "1 ramekin"}]
+    data = _write(export.write_ics,
+                  [_plan(plan_data={"Monday": {"Dinner": foods}})])
+
+    physical_lines = data.split(b"\r\n")
+    assert physical_lines[-1] == b""
+    for line in physical_lines:
+        assert len(line) <= 75
+        line.decode("utf-8")  # no line ends inside a UTF-8 sequence
+
+    unfolded = data.replace(b"\r\n ", b"").decode("utf-8")
+    description = next(line for line in unfolded.split("\r\n")
+                       if line.startswith("DESCRIPTION:"))
+    assert description == ("DESCRIPTION:" + foods[0]["name"]
+                           + " - 1 ramekin")
+    assert any(line.startswith(b" ") for line in physical_lines)
+
+
+def test_ics_places_series_weeks_on_consecutive_weeks(temp_db):
+    db.add_diet("Series")
+    db.add_meal_category(1, "Breakfast")
+    db.add_food(1, 1, "Egg", "Proteins", "2", 5, 0)
+    categories = db.get_meal_categories(1)
+    db.save_plan_series(1, "Block", logic.iter_plan_horizon(1, categories,
+                                                            weeks=3))
+
+    conn = db.get_connection()
+    conn.execute("UPDATE weekly_plans SET created_at = '2024-03-06 10:00:00'")
+    conn.commit()
+    conn.close()
+
+    out = io.BytesIO()
+    export.export_plans("ics", out)
+    starts = re.findall(rb"DTSTART:(\d{8})T080000", out.getvalue())
+
+    # Created on a Wednesday: week 1 starts the following Monday
+    mondays = [date(2024, 3, 11), date(2024, 3, 18), date(2024, 3, 25)]
+    assert [d.decode() for d in starts[::7]] == [
+        f"{monday:%Y%m%d}" for monday in mondays]
+    assert len(starts) == 21
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+
+import db
+
+BASELINE_SCHEMA = """
+CREATE TABLE diets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL
+);
+CREATE TABLE meal_categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    diet_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    order_index INTEGER NOT NULL
+);
+CREATE TABLE foods (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    diet_id INTEGER NOT NULL,
+    meal_category_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    food_type TEXT NOT NULL,
+    portion TEXT,
+    rating INTEGER DEFAULT 3,
+    mandatory INTEGER DEFAULT 0
+);
+CREATE TABLE food_categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    diet_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    order_index INTEGER NOT NULL
+);
+CREATE TABLE weekly_plans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    diet_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    plan_data TEXT NOT NULL
+);
+"""
+
+PLAN = {"Monday": {"Breakfast": [
+    {"name": "Egg", "type": "Proteins", "portion": "2", "rating": 5,
+     "mandatory": True}]}}
+
+
+def _baseline_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO diets (name) VALUES ('Diet')")
+    conn.execute("INSERT INTO meal_categories (diet_id, name, order_index) "
+                 "VALUES (1, 'Breakfast', 1)")
+    conn.execute("INSERT INTO foods (diet_id, meal_category_id, name, "
+                 "food_type, portion, rating, mandatory) "
+                 "VALUES (1, 1, 'Egg', 'Proteins', '2', 5, 1)")
+    conn.execute("INSERT INTO weekly_plans (diet_id, name, created_at, "
+                 "plan_data) VALUES (1, 'Old plan', '2024-03-04 10:00:00', ?)",
+                 (json.dumps(PLAN),))
+    conn.commit()
+    conn.close()
+
+
+def test_baseline_database_is_migrated_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "diet_app.db")
+    _baseline_database(path)
+    monkeypatch.setattr(db, "DB_PATH", path)
+
+    for _ in range(3):
+        db.create_tables()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute(
+        "SELECT week, plans FROM plan_week_stats").fetchall() == [
+        ("2024-W10", 1)]
+    assert conn.execute(
+        "SELECT food_name, times_served FROM plan_food_stats").fetchall() == [
+        ("Egg", 1)]
+    assert conn.execute(
+        "SELECT items_recorded, recency_recorded FROM weekly_plans"
+    ).fetchall() == [(1, 1)]
+    logged = conn.execute(
+        "SELECT table_name, COUNT(*) FROM change_log GROUP BY table_name "
+        "ORDER BY table_name").fetchall()
+    conn.close()
+
+    assert logged == [("diets", 1), ("foods", 1), ("meal_categories", 1),
+                      ("weekly_plans", 1)]
+    assert set(db.get_food_recency_scores(1)) == {("Breakfast", "Egg")}
+
+
+def test_up_to_date_database_needs_no_write_lock(temp_db, monkeypatch):
+    db.add_diet("Diet")
+    db.save_weekly_plan(1, "Plan", PLAN)
+
+    writer = sqlite3.connect(temp_db)
+    writer.execute("BEGIN IMMEDIATE")
+    monkeypatch.setattr(db, "BUSY_TIMEOUT_SECONDS", 0.1)
+    monkeypatch.setattr(db, "WRITE_LOCK_RETRIES", 1)
+    try:
+        db.create_tables()
+    finally:
+        writer.rollback()
+        writer.close()
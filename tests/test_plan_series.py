@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import db
+import logic
+
+
+def _diet_with_one_food(temp_db):
+    db.add_diet("Series")
+    db.add_meal_category(1, "Breakfast")
+    db.add_food(1, 1, "Egg", "Proteins", "2", 5, 0)
+    return db.get_meal_categories(1)
+
+
+def _plan_week_counts():
+    conn = db.get_connection()
+    counts = conn.execute(
+        "SELECT week, plans FROM plan_week_stats ORDER BY week").fetchall()
+    conn.close()
+    return counts
+
+
+def test_series_weeks_count_for_their_own_week(temp_db):
+    categories = _diet_with_one_food(temp_db)
+
+    series_id = db.save_plan_series(
+        1, "Block", logic.iter_plan_horizon(1, categories, weeks=3))
+
+    now = datetime.now()
+    expected_weeks = [
+        db._plan_week((now + timedelta(weeks=n)).strftime("%Y-%m-%d %H:%M:%S"))
+        for n in range(3)
+    ]
+    assert _plan_week_counts() == [(week, 1) for week in expected_weeks]
+
+    # Only the first week has been served so far
+    assert db.get_food_recency_scores(1) == {("Breakfast", "Egg"): 7.0}
+
+    db.delete_plan_series(series_id)
+    assert _plan_week_counts() == []
+    assert db.get_food_recency_scores(1) == {}
+
+
+def test_past_series_weeks_enter_recency_once_due(temp_db):
+    categories = _diet_with_one_food(temp_db)
+    saved_at = (datetime.now() - timedelta(days=10)).strftime(
+        "%Y-%m-%d %H:%M:%S")
+
+    with db.write_transaction() as cursor:
+        for index, week in enumerate(
+                logic.iter_plan_horizon(1, categories, weeks=3), start=1):
+            db._insert_weekly_plan(cursor, 1, f"Week {index}", saved_at, week,
+                                   series_index=index)
+    db.create_tables()
+
+    conn = db.get_connection()
+    recorded = conn.execute(
+        "SELECT series_index, recency_recorded FROM weekly_plans "
+        "ORDER BY series_index").fetchall()
+    conn.close()
+    assert recorded == [(1, 1), (2, 1), (3, 0)]
+
+    decay = 0.5 ** (1 / db.RECENCY_HALF_LIFE_DAYS)
+    expected = 7 * decay ** 10 + 7 * decay ** 3
+    score = db.get_food_recency_scores(1)[("Breakfast", "Egg")]
+    assert abs(score - expected) < 0.01
@@ -0,0 +1,114 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import logic
+
+
+def _food(name, food_type="Proteins"):
+    return {"name": name, "type": food_type, "portion": "1", "rating": 5,
+            "mandatory": False}
+
+
+def _plan(servings):
+    """Plan serving each (meal, food) once per listed day"""
+    plan = {}
+    for day, (meal, name) in servings:
+        plan.setdefault(day, {}).setdefault(meal, []).append(_food(name))
+    return plan
+
+
+def _save_at(days_ago, plan_data):
+    created_at = (datetime.now() - timedelta(days=days_ago)).strftime(
+        "%Y-%m-%d %H:%M:%S")
+    with db.write_transaction() as cursor:
+        return db._insert_weekly_plan(cursor, 1, f"{days_ago} days ago",
+                                      created_at, plan_data)
+
+
+def _decay(days):
+    return 0.5 ** (days / db.RECENCY_HALF_LIFE_DAYS)
+
+
+@pytest.fixture
+def diet(temp_db):
+    db.add_diet("Recency")
+    db.add_meal_category(1, "Breakfast")
+    db.add_meal_category(1, "Lunch")
+    return db.get_meal_categories(1)
+
+
+def test_saving_a_plan_raises_only_the_served_foods(diet):
+    _save_at(7, _plan([("Monday", ("Breakfast", "Egg")),
+                       ("Monday", ("Lunch", "Rice")),
+                       ("Tuesday", ("Lunch", "Fish"))]))
+    before = db.get_food_recency_scores(1)
+
+    db.save_weekly_plan(1, "Now", _plan([("Monday", ("Breakfast", "Egg")),
+                                         ("Tuesday", ("Breakfast", "Egg")),
+                                         ("Monday", ("Lunch", "Pasta"))]))
+    after = db.get_food_recency_scores(1)
+
+    served = {("Breakfast", "Egg"): 2, ("Lunch", "Pasta"): 1}
+    assert set(after) == set(before) | set(served)
+    for key, score in after.items():
+        expected = before.get(key, 0.0) + served.get(key, 0)
+        assert score == pytest.approx(expected, abs=1e-3), key
+
+
+def test_deleting_an_older_plan_subtracts_its_decayed_share(diet):
+    # The newer plan is saved first, so the older one is added as a share
+    newer = _save_at(2, _plan([("Monday", ("Lunch", "Rice")),
+                               ("Tuesday", ("Lunch", "Rice")),
+                               ("Monday", ("Lunch", "Fish"))]))
+    older = _save_at(10, _plan([("Monday", ("Lunch", "Rice")),
+                                ("Tuesday", ("Lunch", "Rice")),
+                                ("Wednesday", ("Lunch", "Rice")),
+                                ("Monday", ("Lunch", "Pasta"))]))
+
+    scores = db.get_food_recency_scores(1)
+    assert scores[("Lunch", "Rice")] == pytest.approx(
+        2 * _decay(2) + 3 * _decay(10), abs=1e-3)
+    assert scores[("Lunch", "Pasta")] == pytest.approx(_decay(10), abs=1e-3)
+
+    db.delete_weekly_plan(older)
+    assert db.get_food_recency_scores(1) == pytest.approx({
+        ("Lunch", "Rice"): 2 * _decay(2),
+        ("Lunch", "Fish"): _decay(2)
+    }, abs=1e-3)
+
+    db.delete_weekly_plan(newer)
+    assert db.get_food_recency_scores(1) == {}
+
+
+def test_recency_weighting_down_weights_a_recent_food(diet):
+    lunch = diet[1][0]
+    db.add_food(1, lunch, "Rice", "Carbohydrates", "80g", 5, 0)
+    db.add_food(1, lunch, "Pasta", "Carbohydrates", "90g", 5, 0)
+    db.save_weekly_plan(1, "History", _plan(
+        [(day, ("Lunch", "Rice")) for day in logic.DAYS]))
+
+    def rice_share(weighting):
+        random.seed(5)
+        counts = Counter(
+            food['name']
+            for _ in range(100)
+            for day_plan in logic.generate_weekly_plan(
+                1, diet, weighting=weighting).values()
+            for food in day_plan["Lunch"]
+        )
+        return counts["Rice"] / sum(counts.values())
+
+    # Equal ratings: 1/2 by rating; weight 25 / (1 + 7) against 25 by recency
+    assert rice_share("rating") == pytest.approx(0.5, abs=0.06)
+    assert rice_share("recency") == pytest.approx(1 / 9, abs=0.04)
+
+
+def test_unknown_weighting_is_rejected(diet):
+    with pytest.raises(ValueError, match="Unknown weighting"):
+        logic.generate_weekly_plan(1, diet, weighting="recent")
+    with pytest.raises(ValueError, match="Unknown weighting"):
+        list(logic.iter_plan_horizon(1, diet, weeks=2, weighting="Recency"))
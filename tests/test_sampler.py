@@ -0,0 +1,152 @@
+import os
+import random
+from collections import Counter
+
+import pytest
+
+import db
+import logic
+
+ENGINES = [logic.random_choice_engine, logic.cumulative_weights_engine]
+
+# Chi-square critical values at p = 0.001 by degrees of freedom
+CHI2_CRITICAL = {1: 10.83, 2: 13.82, 3: 16.27, 4: 18.47, 5: 20.52}
+
+# Plans generated by the default smoke run; raise SAMPLER_PLANS for a
+# stricter check of the full generator
+PLANS = int(os.environ.get("SAMPLER_PLANS", 300))
+
+# Engine draws of the slow run (pytest --run-slow)
+SLOW_DRAWS = int(os.environ.get("SAMPLER_DRAWS", 10 ** 6))
+
+
+@pytest.fixture
+def synthetic_diet(temp_db):
+    """Two meals; optional foods of several types with mixed ratings"""
+    db.add_diet("Synthetic")
+    db.add_meal_category(1, "Breakfast")
+    db.add_meal_category(1, "Lunch")
+    breakfast, lunch = [cat_id for cat_id, _, _ in db.get_meal_categories(1)]
+
+    foods = [
+        (breakfast, "Coffee", "Drinks", 3, 1),
+        (breakfast, "Apple", "Fruits", 5, 0),
+        (breakfast, "Banana", "Fruits", 3, 0),
+        (breakfast, "Kiwi", "Fruits", 1, 0),
+        (breakfast, "Egg", "Proteins", 4, 0),
+        (breakfast, "Yogurt", "Proteins", 2, 0),
+        (lunch, "Rice", "Carbohydrates", 5, 0),
+        (lunch, "Pasta", "Carbohydrates", 4, 0),
+        (lunch, "Bread", "Carbohydrates", 2, 0),
+        (lunch, "Potato", "Carbohydrates", 3, 0),
+        (lunch, "Salad", "Vegetables", 4, 1),
+        (lunch, "Chicken", "Proteins", 5, 0),
+        (lunch, "Tofu", "Proteins", 5, 0),
+        (lunch, "Fish", "Proteins", 1, 0),
+    ]
+    for meal_id, name, food_type, rating, mandatory in foods:
+        db.add_food(1, meal_id, name, food_type, "1", rating, mandatory)
+
+    return db.get_meal_categories(1)
+
+
+def _chi_square(counts: Counter, probabilities: dict, draws: int):
+    return sum((counts[name] - draws * p) ** 2 / (draws * p)
+               for name, p in probabilities.items())
+
+
+def _optional_foods_by_type(meal_categories):
+    for cat_name, _, foods_by_type in logic._load_meal_foods(meal_categories):
+        for food_type, type_foods in foods_by_type.items():
+            yield cat_name, food_type, type_foods
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.__name__)
+def test_generated_frequencies_match_rating_weights(synthetic_diet, engine):
+    random.seed(1234)
+    plans = [logic.generate_weekly_plan(1, synthetic_diet, engine=engine)
+             for _ in range(PLANS)]
+
+    for cat_name, food_type, type_foods in _optional_foods_by_type(
+            synthetic_diet):
+        counts = Counter(
+            food['name']
+            for plan in plans
+            for day_plan in plan.values()
+            for food in day_plan[cat_name]
+            if not food['mandatory'] and food['type'] == food_type
+        )
+        draws = PLANS * len(logic.DAYS)
+        assert sum(counts.values()) == draws
+
+        probabilities = logic.selection_probabilities(type_foods)
+        ratings = {f[1]: f[4] for f in type_foods}
+        total = sum(r ** 2 for r in ratings.values())
+        assert probabilities == pytest.approx(
+            {name: r ** 2 / total for name, r in ratings.items()})
+
+        statistic = _chi_square(counts, probabilities, draws)
+        assert statistic < CHI2_CRITICAL[len(type_foods) - 1], \
+            f"{cat_name}/{food_type}: chi-square {statistic:.1f}"
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.__name__)
+def test_engine_follows_variety_adjusted_weights(synthetic_diet, engine):
+    random.seed(99)
+    variety = {("Lunch", "Rice"): 3.0, ("Lunch", "Pasta"): 0.5}
+    _, _, type_foods = next(
+        item for item in _optional_foods_by_type(synthetic_diet)
+        if item[1] == "Carbohydrates")
+
+    weights = [logic.food_weight(f[4], variety.get(("Lunch", f[1]), 0.0))
+               for f in type_foods]
+    draws = 20000
+    counts = Counter(engine(type_foods, weights)[1] for _ in range(draws))
+
+    probabilities = logic.selection_probabilities(type_foods, "Lunch", variety)
+    statistic = _chi_square(counts, probabilities, draws)
+    assert statistic < CHI2_CRITICAL[len(type_foods) - 1]
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.__name__)
+def test_engine_matches_rating_weights_at_scale(synthetic_diet, engine):
+    random.seed(2024)
+
+    for cat_name, food_type, type_foods in _optional_foods_by_type(
+            synthetic_diet):
+        weights = [logic.food_weight(f[4]) for f in type_foods]
+        counts = Counter(engine(type_foods, weights)[1]
+                         for _ in range(SLOW_DRAWS))
+
+        probabilities = logic.selection_probabilities(type_foods)
+        statistic = _chi_square(counts, probabilities, SLOW_DRAWS)
+        assert statistic < CHI2_CRITICAL[len(type_foods) - 1], \
+            f"{cat_name}/{food_type}: chi-square {statistic:.1f}"
+
+
+@pytest.mark.parametrize("engine", ENGINES, ids=lambda e: e.__name__)
+@pytest.mark.parametrize("weighting", ["rating", "recency"])
+def test_plans_keep_structural_invariants(synthetic_diet, engine, weighting):
+    random.seed(7)
+    db.save_weekly_plan(1, "History",
+                        logic.generate_weekly_plan(1, synthetic_diet))
+
+    for week_plan in logic.iter_plan_horizon(1, synthetic_diet, weeks=50,
+                                             weighting=weighting,
+                                             engine=engine):
+        assert logic.check_plan_invariants(week_plan, synthetic_diet) == []
+
+
+def test_invariant_check_reports_violations(synthetic_diet):
+    plan = logic.generate_weekly_plan(1, synthetic_diet)
+    plan["Monday"]["Breakfast"] = [
+        food for food in plan["Monday"]["Breakfast"]
+        if food['name'] != "Coffee"
+    ]
+    plan["Tuesday"]["Lunch"].append(dict(plan["Tuesday"]["Lunch"][-1]))
+
+    problems = logic.check_plan_invariants(plan, synthetic_diet)
+
+    assert any(p.startswith("Monday/Breakfast: mandatory") for p in problems)
+    assert any(p.startswith("Tuesday/Lunch: picks") for p in problems)
@@ -0,0 +1,48 @@
+import pytest
+
+import db
+from shopping import aggregate_plans, parse_portion
+
+
+@pytest.mark.parametrize("portion, expected", [
+    ("30g", (30, "g")),
+    ("1 1/2 cups", (360, "ml")),
+    ("2 slices", (2, "slice")),
+    ("1 slice", (1, "slice")),
+    ("2 glasses", (2, "glass")),
+    ("1 glass", (1, "glass")),
+    ("3 tomatoes", (3, "tomato")),
+    ("2 pinches", (2, "pinch")),
+    ("2 boxes", (2, "box")),
+    ("4 berries", (4, "berry")),
+    ("2 leaves", (2, "leaf")),
+    ("3 eggs", (3, "egg")),
+    ("2 pcs", (2, "unit")),
+    ("1", (1, "unit")),
+    ("some", None),
+])
+def test_parse_portion(portion, expected):
+    assert parse_portion(portion) == expected
+
+
+def test_singular_and_plural_portions_merge():
+    food = {"name": "Milk", "type": "Dairy"}
+    plan = {"Monday": {"Breakfast": [dict(food, portion="1 glass"),
+                                     dict(food, portion="2 glasses")]}}
+
+    rows = aggregate_plans([plan])
+
+    assert [(r["quantity"], r["unit"], r["servings"]) for r in rows] == [
+        (3, "glass", 2)]
+
+
+def test_plan_summaries_list_plans_without_plan_data(temp_db):
+    db.add_diet("Diet")
+    first = db.save_weekly_plan(1, "First", {"Monday": {}})
+    second = db.save_weekly_plan(1, "Second", {"Monday": {}})
+
+    summaries = db.get_weekly_plan_summaries(1)
+
+    assert sorted((plan_id, name) for plan_id, name, _ in summaries) == [
+        (first, "First"), (second, "Second")]
+    assert all(len(summary) == 3 for summary in summaries)
@@ -0,0 +1,222 @@
+import sqlite3
+
+import pytest
+
+import db
+import sync
+from tenancy import use_database
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    """Replica a with a small diet and b cloned from it"""
+    path_a = str(tmp_path / "a.db")
+    path_b = str(tmp_path / "b.db")
+
+    with use_database(path_a):
+        db.create_tables()
+        db.add_diet("Diet")
+        db.add_meal_category(1, "Breakfast")
+        db.add_meal_category(1, "Lunch")
+        db.add_food(1, 1, "Egg", "Proteins", "2", 5, 1)
+        db.add_food(1, 1, "Apple", "Fruits", "1", 4, 0)
+        db.add_food(1, 2, "Rice", "Carbohydrates", "80g", 4, 0)
+        db.save_weekly_plan(1, "Plan", {"Monday": {"Breakfast": [
+            {"name": "Egg", "type": "Proteins", "portion": "2", "rating": 5,
+             "mandatory": True}]}})
+
+    sync.clone_replica(path_a, path_b)
+    return path_a, path_b
+
+
+def _state(path):
+    """Replica contents keyed by uid, independent of local ids"""
+    conn = sqlite3.connect(path)
+    state = {
+        "diets": conn.execute(
+            "SELECT uid, name FROM diets ORDER BY uid").fetchall(),
+        "meal_categories": conn.execute(
+            """
+            SELECT m.uid, d.uid, m.name, m.order_index
+            FROM meal_categories m JOIN diets d ON d.id = m.diet_id
+            ORDER BY m.uid
+            """).fetchall(),
+        "foods": conn.execute(
+            """
+            SELECT f.uid, m.uid, f.name, f.portion, f.rating, f.mandatory
+            FROM foods f LEFT JOIN meal_categories m
+                ON m.id = f.meal_category_id
+            ORDER BY f.uid
+            """).fetchall(),
+        "plan_series": conn.execute(
+            "SELECT uid, name, weeks FROM plan_series ORDER BY uid").fetchall(),
+        "weekly_plans": conn.execute(
+            "SELECT uid, name, plan_data FROM weekly_plans ORDER BY uid"
+        ).fetchall(),
+        "plan_food_stats": conn.execute(
+            """
+            SELECT meal_name, food_name, times_served FROM plan_food_stats
+            ORDER BY meal_name, food_name
+            """).fetchall()
+    }
+    conn.close()
+    return state
+
+
+def _food_names(path):
+    return sorted(name for _, _, name, *_ in _state(path)["foods"])
+
+
+def _category_id(path, name):
+    with use_database(path):
+        return next(cat_id for cat_id, cat_name, _ in db.get_meal_categories(1)
+                    if cat_name == name)
+
+
+def test_concurrent_edits_converge(replicas):
+    path_a, path_b = replicas
+
+    with use_database(path_a):
+        db.add_food(1, 1, "Banana", "Fruits", "1", 3, 0)
+        db.update_weekly_plan_name(1, "Renamed on a")
+        db.move_meal_category(2, "up")
+    with use_database(path_b):
+        db.add_food(1, 2, "Pasta", "Carbohydrates", "90g", 4, 0)
+        db.delete_food(2)  # Apple
+        db.update_weekly_plan_name(1, "Renamed on b")  # later, wins
+
+    sync.sync_replicas(path_a, path_b)
+
+    assert _state(path_a) == _state(path_b)
+    assert _food_names(path_a) == ["Banana", "Egg", "Pasta", "Rice"]
+    assert [p[1] for p in _state(path_a)["weekly_plans"]] == ["Renamed on b"]
+
+
+def test_food_added_under_deleted_category_converges(replicas):
+    path_a, path_b = replicas
+
+    with use_database(path_a):
+        db.add_food(1, _category_id(path_a, "Lunch"), "Soup", "Soups", "1", 4,
+                    0)
+    with use_database(path_b):
+        db.delete_meal_category(_category_id(path_b, "Lunch"))
+
+    sync.sync_replicas(path_a, path_b)
+
+    assert _state(path_a) == _state(path_b)
+    assert _food_names(path_a) == ["Apple", "Egg"]
+
+    # Either pull order gives the same result
+    assert sync.sync_replicas(path_b, path_a) == (0, 0)
+    assert _state(path_a) == _state(path_b)
+
+
+def test_recreated_category_brings_back_skipped_foods(replicas):
+    path_a, path_b = replicas
+
+    with use_database(path_b):
+        db.delete_meal_category(_category_id(path_b, "Lunch"))
+    with use_database(path_a):
+        db.add_food(1, _category_id(path_a, "Lunch"), "Soup", "Soups", "1", 4,
+                    0)
+    with use_database(path_b):
+        sync.pull_changes(path_a)  # Soup is skipped, Lunch is gone here
+
+    # Moving Lunch on a is newer than its delete on b: Lunch survives
+    with use_database(path_a):
+        db.move_meal_category(_category_id(path_a, "Lunch"), "up")
+
+    sync.sync_replicas(path_a, path_b)
+
+    assert _state(path_a) == _state(path_b)
+    assert _food_names(path_a) == ["Apple", "Egg", "Soup"]
+
+
+def test_repeated_sync_is_a_no_op(replicas):
+    path_a, path_b = replicas
+
+    with use_database(path_a):
+        db.add_diet("Second")
+    assert sync.sync_replicas(path_a, path_b) == (0, 1)
+    assert sync.sync_replicas(path_a, path_b) == (0, 0)
+
+
+def test_only_the_delta_is_read(replicas):
+    path_a, path_b = replicas
+    with use_database(path_b):
+        sync.pull_changes(path_a)
+
+    with use_database(path_a):
+        db.add_food(1, 1, "Pear", "Fruits", "1", 3, 0)
+        remote_id = db.get_replica_id()
+
+    with use_database(path_b):
+        watermark = db.get_peer_watermark(remote_id)
+    with use_database(path_a):
+        delta = list(db.iter_changes(watermark))
+
+    assert [(table, op) for _, _, table, _, op, _, _ in delta] == [
+        ("foods", "upsert")]
+
+
+def test_fresh_replica_pulls_compacted_log(replicas):
+    path_a, path_b = replicas
+
+    with use_database(path_b):
+        for name in ("One", "Two", "Three"):
+            db.update_weekly_plan_name(1, name)
+        db.delete_meal_category(_category_id(path_b, "Lunch"))
+    sync.sync_replicas(path_a, path_b)
+
+    with use_database(path_a):
+        assert db.compact_change_log() > 0
+
+    path_c = path_a.replace("a.db", "c.db")
+    with use_database(path_c):
+        db.create_tables()
+        sync.pull_changes(path_a)
+
+    assert _state(path_c) == _state(path_a) == _state(path_b)
+
+
+def _change_log_size(path):
+    conn = sqlite3.connect(path)
+    size = conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+    conn.close()
+    return size
+
+
+def test_local_writes_keep_the_change_log_bounded(replicas, monkeypatch):
+    path_a, path_b = replicas
+    monkeypatch.setattr(db, "COMPACT_EVERY_OPS", 20)
+    rows = _change_log_size(path_a)
+
+    with use_database(path_a):
+        for n in range(200):
+            db.update_weekly_plan_name(1, f"Name {n}")
+            db.update_weekly_plan_name(1, f"Name {n}")
+            assert _change_log_size(path_a) < rows + 20
+
+    sync.sync_replicas(path_a, path_b)
+    assert _state(path_a) == _state(path_b)
+    assert [p[1] for p in _state(path_b)["weekly_plans"]] == ["Name 199"]
+
+
+def test_merges_keep_the_change_log_bounded(replicas, monkeypatch):
+    path_a, path_b = replicas
+    monkeypatch.setattr(db, "COMPACT_EVERY_OPS", 20)
+    rows = _change_log_size(path_b)
+
+    for n in range(30):
+        with use_database(path_a):
+            db.update_weekly_plan_name(1, f"Name {n}")
+            db.add_food(1, 1, f"Food {n}", "Fruits", "1", 3, 0)
+            db.delete_food(next(food_id for food_id, name, *_
+                                in db.get_foods_by_category(1)
+                                if name == f"Food {n}"))
+        sync.sync_replicas(path_a, path_b)
+
+        # Deleted foods keep one tombstone each; everything else is bounded
+        assert _change_log_size(path_b) <= rows + (n + 1) + 20
+
+    assert _state(path_a) == _state(path_b)
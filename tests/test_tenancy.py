@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+import db
+import tenancy
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    pool = tenancy.ShardPool(tenant_dir=str(tmp_path / "tenants"),
+                             catalog_path=str(tmp_path / "catalog.db"),
+                             max_open=2)
+    monkeypatch.setattr(tenancy, "_pool", pool)
+    yield pool
+    pool.close_all()
+
+
+def _add_plans(count):
+    db.add_diet("Diet")
+    db.add_meal_category(1, "Lunch")
+    db.add_food(1, 1, "Rice", "Carbohydrates", "100g", 4, 0)
+    for i in range(count):
+        db.save_weekly_plan(1, f"Plan {i}",
+                            {"Monday": {"Lunch": [{"name": "Rice",
+                                                   "type": "Carbohydrates",
+                                                   "portion": "100g",
+                                                   "rating": 4,
+                                                   "mandatory": False}]}})
+
+
+def test_tenants_are_isolated(pool):
+    for user in ("alice", "bob", "carol"):
+        with tenancy.use_tenant(user):
+            db.add_diet(f"{user} diet")
+
+    for user in ("alice", "bob", "carol"):
+        with tenancy.use_tenant(user):
+            assert [name for _, name in db.get_diets()] == [f"{user} diet"]
+
+    assert len(pool.open_shards()) <= 2
+
+
+def test_streaming_read_does_not_block_other_sessions(pool):
+    with tenancy.use_tenant("alice"):
+        _add_plans(5)
+        plans = db.iter_weekly_plans()
+        next(plans)
+
+        results = []
+
+        def other_session():
+            with tenancy.use_tenant("alice"):
+                db.add_diet("Second diet")
+                results.append(len(db.get_diets()))
+
+        thread = threading.Thread(target=other_session)
+        thread.start()
+        thread.join()
+
+        # A blocked session would fail with "database is locked" instead
+        assert results == [2]
+        assert len(list(plans)) == 4
+
+
+def test_callback_without_context_writes_to_the_tenant(pool, temp_db):
+    # Same ids in the default database and the tenant's shard
+    db.add_diet("Shared diet")
+    with tenancy.use_tenant("alice"):
+        db.add_diet("Alice diet")
+
+    def button_callback():
+        # A fresh thread, like a Streamlit callback, has no active tenant
+        assert db.CONNECTION_FACTORY.get() is None
+        tenancy.run_as_tenant("alice", db.delete_food_category, 1,
+                              expected_version=None)
+        tenancy.run_as_tenant("alice", db.add_meal_category, 1, "Lunch")
+
+    with db.write_transaction() as cursor:
+        cursor.execute("INSERT INTO food_categories (diet_id, name, "
+                       "order_index) VALUES (1, 'Shared', 1)")
+    with tenancy.use_tenant("alice"):
+        db.add_food_category(1, "Alice")
+
+    thread = threading.Thread(target=button_callback)
+    thread.start()
+    thread.join()
+
+    assert [fc[1] for fc in db.get_food_categories(1)] == ["Shared"]
+    assert db.get_meal_categories(1) == []
+    with tenancy.use_tenant("alice"):
+        assert db.get_food_categories(1) == []
+        assert [c[1] for c in db.get_meal_categories(1)] == ["Lunch"]